@@ -1,11 +1,11 @@
-import requests
 import logging
 from datetime import datetime, timezone, timedelta
 import random
-import time
+import threading
 from collections import defaultdict
 from typing import List, Dict, Any, Optional
 from .client import InstagramClient, LoginError
+from .http_session import SESSION
 from config import settings
 
 logging.basicConfig(level=logging.INFO)
@@ -13,27 +13,49 @@ logger = logging.getLogger(__name__)
 BRT = timezone(timedelta(hours=-3))
 
 
+class AutomationStopped(Exception):
+    """Exceção lançada nos checkpoints do carrossel quando uma parada foi solicitada."""
+    pass
+
+
 class CarouselAutomator:
-    def __init__(self, rest_days: int = 2, wait_min_seconds: int = 5, wait_max_seconds: int = 15):
+    def __init__(
+        self,
+        rest_days: int = 2,
+        wait_min_seconds: int = 5,
+        wait_max_seconds: int = 15,
+        stop_event: Optional[threading.Event] = None,
+    ):
         self.db_url = settings.DATABASE_API_URL.rstrip("/")
         self.rest_days = rest_days
         self.wait_min_seconds = wait_min_seconds
         self.wait_max_seconds = wait_max_seconds
         self.automation_run_id: Optional[int] = None
+        self.stop_event = stop_event or threading.Event()
+
+    def _checkpoint(self) -> None:
+        """Ponto de parada cooperativo: interrompe o ciclo se stop_event estiver setado."""
+        if self.stop_event.is_set():
+            raise AutomationStopped()
+
+    def _sleep(self, seconds: float) -> None:
+        """Como time.sleep, mas retorna (com AutomationStopped) assim que a parada é pedida."""
+        if self.stop_event.wait(seconds):
+            raise AutomationStopped()
 
     def _get_restaurants(self) -> List[Dict[Any, Any]]:
-        resp = requests.get(f"{self.db_url}/restaurants/")
+        resp = SESSION.get(f"{self.db_url}/restaurants/")
         resp.raise_for_status()
         return resp.json()
 
     def _get_personas(self) -> List[Dict[Any, Any]]:
-        resp = requests.get(f"{self.db_url}/personas/")
+        resp = SESSION.get(f"{self.db_url}/personas/")
         resp.raise_for_status()
         return resp.json()
 
     def _get_phrases(self, persona_id: int, is_cliente: bool) -> List[Dict[Any, Any]]:
         # Phrases are independent in the database API; fetch global list
-        resp = requests.get(f"{self.db_url}/phrases/")
+        resp = SESSION.get(f"{self.db_url}/phrases/")
         resp.raise_for_status()
         all_phrases = sorted(resp.json(), key=lambda x: x.get("order", 0))
         
@@ -43,61 +65,17 @@ class CarouselAutomator:
         return all_phrases
 
     def _get_last_message(self, restaurant_id: int) -> Optional[Dict[str, Any]]:
-        resp = requests.get(f"{self.db_url}/last-message/{restaurant_id}")
+        resp = SESSION.get(f"{self.db_url}/last-message/{restaurant_id}")
         if resp.status_code == 200 and resp.json():
             return resp.json()
         return None
 
     def _log_message(self, restaurant_id: int, persona_id: int, phrase_id: int, success: bool):
-        # Emit an event to the frontend websocket hub with stats and related objects
-        stats = {
-            "total": 1,  # This will be incremented by the database API
-            "success": 1 if success else 0,
-            "fail": 0 if success else 1
-        }
-
-        # Try to get restaurant details
-        restaurant = {}
-        try:
-            r = requests.get(f"{self.db_url}/restaurants/{restaurant_id}", timeout=3)
-            if r.status_code == 200:
-                restaurant = r.json()
-        except Exception as e:
-            logger.debug(f"Failed to fetch restaurant {restaurant_id}: {e}")
-
-        # Try to get persona details
-        persona = {}
-        try:
-            p = requests.get(f"{self.db_url}/personas/{persona_id}", timeout=3)
-            if p.status_code == 200:
-                persona = p.json()
-        except Exception as e:
-            logger.debug(f"Failed to fetch persona {persona_id}: {e}")
-
-        # Try to get phrase details
-        phrase = {}
-        try:
-            ph = requests.get(f"{self.db_url}/phrases/{phrase_id}", timeout=3)
-            if ph.status_code == 200:
-                phrase = ph.json()
-        except Exception as e:
-            logger.debug(f"Failed to fetch phrase {phrase_id}: {e}")
-
-        # Create the event with all collected information
-        event = {
-            "type": "dm_log",
-            "success": bool(success),
-            "sent_at": datetime.now(BRT).isoformat(),
-            "automation_run_id": self.automation_run_id,
-            "stats": stats,
-            "restaurant": restaurant or {"id": restaurant_id},
-            "persona": persona or {"id": persona_id},
-            "phrase": phrase or {"id": phrase_id},
-        }
-
+        # Só os IDs vão no POST: a database-api monta o evento dm_log (restaurante, persona,
+        # frase e stats) a partir deles, então não há GETs de detalhe por DM enviada.
         try:
             # Persist log + emitir evento via database-api (/log/ já grava em MessageLog e dispara WS)
-            response = requests.post(
+            response = SESSION.post(
                 f"{self.db_url}/log/",
                 json={
                     "restaurant_id": restaurant_id,
@@ -207,7 +185,7 @@ class CarouselAutomator:
                     self.wait_max_seconds * 1.2
                 )
                 logger.debug(f"Aguardando {interval:.2f}s antes de enviar próxima parte da mensagem")
-                time.sleep(interval)
+                self._sleep(interval)
 
         return overall_success, failed_index
 
@@ -216,7 +194,7 @@ class CarouselAutomator:
 
         # Registra início de um ciclo de automação no banco
         try:
-            resp = requests.post(f"{self.db_url}/runs/")
+            resp = SESSION.post(f"{self.db_url}/runs/")
             if resp.status_code == 201:
                 data = resp.json() or {}
                 self.automation_run_id = data.get("id")
@@ -268,82 +246,69 @@ class CarouselAutomator:
             phrase_index_cliente = 0
             phrase_index_nao_cliente = 0
 
-            for restaurant in block_restaurants:
-                # Filtra frases baseado no campo cliente do restaurante
-                is_cliente = restaurant.get("cliente", False)
-                phrases = self._get_phrases(persona_id=0, is_cliente=is_cliente)  # persona_id é ignorado na implementação atual
-                if not phrases:
-                    logger.warning(
-                        f"@{restaurant.get('instagram_username')} | "
-                        f"Nenhuma frase configurada para {'clientes' if is_cliente else 'não clientes'}! Pulando restaurante."
-                    )
-                    continue
-                
-                # Usa índice apropriado baseado no tipo
-                phrase_index = phrase_index_cliente if is_cliente else phrase_index_nao_cliente
-                rest_id = restaurant["id"]
-                rest_username = restaurant["instagram_username"]
-
-                # Consulta último envio para decidir descanso e rotação de persona/frase
-                last_msg = self._get_last_message(rest_id)
-
-                # Verifica descanso em dias para este restaurante (horário de Brasília)
-                if last_msg and last_msg.get("sent_at"):
-                    raw_sent_at = last_msg["sent_at"]
-                    try:
-                        if raw_sent_at.endswith("Z"):
-                            last_sent = datetime.fromisoformat(raw_sent_at.replace("Z", "+00:00")).astimezone(BRT)
-                        else:
-                            last_sent = datetime.fromisoformat(raw_sent_at)
-                            if last_sent.tzinfo is None:
-                                last_sent = last_sent.replace(tzinfo=BRT)
-                            else:
-                                last_sent = last_sent.astimezone(BRT)
+            try:
+                for restaurant in block_restaurants:
+                    self._checkpoint()
 
-                        now_brt = datetime.now(BRT)
-                        days_since = (now_brt.date() - last_sent.date()).days
-                    except Exception as e:
+                    # Filtra frases baseado no campo cliente do restaurante
+                    is_cliente = restaurant.get("cliente", False)
+                    phrases = self._get_phrases(persona_id=0, is_cliente=is_cliente)  # persona_id é ignorado na implementação atual
+                    if not phrases:
                         logger.warning(
-                            f"@{rest_username} | Erro ao interpretar sent_at='{raw_sent_at}' ({e}) → tratando como em descanso. Pulando."
+                            f"@{restaurant.get('instagram_username')} | "
+                            f"Nenhuma frase configurada para {'clientes' if is_cliente else 'não clientes'}! Pulando restaurante."
                         )
                         continue
+                
+                    # Usa índice apropriado baseado no tipo
+                    phrase_index = phrase_index_cliente if is_cliente else phrase_index_nao_cliente
+                    rest_id = restaurant["id"]
+                    rest_username = restaurant["instagram_username"]
 
-                    if days_since < self.rest_days:
-                        logger.info(
-                            f"@{rest_username} | Último envio há {days_since} dia(s) → em descanso ({self.rest_days} dias). Pulando."
-                        )
-                        continue
+                    # Consulta último envio para decidir descanso e rotação de persona/frase
+                    last_msg = self._get_last_message(rest_id)
 
-                # Escolha da persona respeitando descanso e evitando repetição imediata
-                persona_index = base_persona_index
-                if last_msg:
-                    last_persona_id = last_msg.get("persona_id")
-                    if last_persona_id is not None and last_persona_id == personas[persona_index]["id"]:
-                        persona_index = (persona_index + 1) % len(personas)
+                    # Verifica descanso em dias para este restaurante (horário de Brasília)
+                    if last_msg and last_msg.get("sent_at"):
+                        raw_sent_at = last_msg["sent_at"]
+                        try:
+                            if raw_sent_at.endswith("Z"):
+                                last_sent = datetime.fromisoformat(raw_sent_at.replace("Z", "+00:00")).astimezone(BRT)
+                            else:
+                                last_sent = datetime.fromisoformat(raw_sent_at)
+                                if last_sent.tzinfo is None:
+                                    last_sent = last_sent.replace(tzinfo=BRT)
+                                else:
+                                    last_sent = last_sent.astimezone(BRT)
+
+                            now_brt = datetime.now(BRT)
+                            days_since = (now_brt.date() - last_sent.date()).days
+                        except Exception as e:
+                            logger.warning(
+                                f"@{rest_username} | Erro ao interpretar sent_at='{raw_sent_at}' ({e}) → tratando como em descanso. Pulando."
+                            )
+                            continue
 
-                persona = personas[persona_index]
+                        if days_since < self.rest_days:
+                            logger.info(
+                                f"@{rest_username} | Último envio há {days_since} dia(s) → em descanso ({self.rest_days} dias). Pulando."
+                            )
+                            continue
 
-                # Cliente do Instagram configurado com intervalo de espera configurável
-                # Reutiliza o mesmo client para a mesma persona dentro do bloco
-                persona_id = persona["id"]
-                client = persona_clients.get(persona_id)
-                if client is None:
-                    try:
-                        client = InstagramClient(
-                            username=persona["instagram_username"],
-                            password=persona["instagram_password"],
-                            wait_min_seconds=self.wait_min_seconds,
-                            wait_max_seconds=self.wait_max_seconds,
-                        )
-                        persona_clients[persona_id] = client
-                    except LoginError as e:
-                        logger.error(f"Erro de login para persona @{persona.get('instagram_username')}: {e}. Tentando próxima persona.")
-                        # Tenta próxima persona para o mesmo restaurante
-                        persona_index = (persona_index + 1) % len(personas)
-                        persona = personas[persona_index]
-                        persona_id = persona["id"]
-                        
-                        # Tenta criar cliente para a próxima persona
+                    # Escolha da persona respeitando descanso e evitando repetição imediata
+                    persona_index = base_persona_index
+                    if last_msg:
+                        last_persona_id = last_msg.get("persona_id")
+                        if last_persona_id is not None and last_persona_id == personas[persona_index]["id"]:
+                            persona_index = (persona_index + 1) % len(personas)
+
+                    persona = personas[persona_index]
+
+                    # Cliente do Instagram configurado com intervalo de espera configurável
+                    # Reutiliza o mesmo client para a mesma persona dentro do bloco
+                    persona_id = persona["id"]
+                    client = persona_clients.get(persona_id)
+                    if client is None:
                         try:
                             client = InstagramClient(
                                 username=persona["instagram_username"],
@@ -352,53 +317,69 @@ class CarouselAutomator:
                                 wait_max_seconds=self.wait_max_seconds,
                             )
                             persona_clients[persona_id] = client
-                        except LoginError as e2:
-                            logger.error(f"Erro de login também para próxima persona @{persona.get('instagram_username')}: {e2}. Pulando restaurante.")
-                            # Se a próxima persona também falhar, pula este restaurante
-                            continue
-
-                # Seleciona frase em carrossel por bloco:
-                # restaurante 0 -> frase 0, restaurante 1 -> frase 1, se acabar volta para frase 0
-                next_phrase = phrases[phrase_index % len(phrases)]
+                        except LoginError as e:
+                            logger.error(f"Erro de login para persona @{persona.get('instagram_username')}: {e}. Tentando próxima persona.")
+                            # Tenta próxima persona para o mesmo restaurante
+                            persona_index = (persona_index + 1) % len(personas)
+                            persona = personas[persona_index]
+                            persona_id = persona["id"]
+                        
+                            # Tenta criar cliente para a próxima persona
+                            try:
+                                client = InstagramClient(
+                                    username=persona["instagram_username"],
+                                    password=persona["instagram_password"],
+                                    wait_min_seconds=self.wait_min_seconds,
+                                    wait_max_seconds=self.wait_max_seconds,
+                                )
+                                persona_clients[persona_id] = client
+                            except LoginError as e2:
+                                logger.error(f"Erro de login também para próxima persona @{persona.get('instagram_username')}: {e2}. Pulando restaurante.")
+                                # Se a próxima persona também falhar, pula este restaurante
+                                continue
+
+                    # Seleciona frase em carrossel por bloco:
+                    # restaurante 0 -> frase 0, restaurante 1 -> frase 1, se acabar volta para frase 0
+                    next_phrase = phrases[phrase_index % len(phrases)]
                 
-                # Incrementa o índice apropriado baseado no tipo
-                if is_cliente:
-                    phrase_index_cliente += 1
-                else:
-                    phrase_index_nao_cliente += 1
-
-                # 1) Primeiro tenta enviar diretamente todas as partes da mensagem
-                success, failed_index = self._send_multipart_dm(
-                    client,
-                    rest_username,
-                    next_phrase["text"],
-                    start_index=0,
-                )
+                    # Incrementa o índice apropriado baseado no tipo
+                    if is_cliente:
+                        phrase_index_cliente += 1
+                    else:
+                        phrase_index_nao_cliente += 1
+
+                    # 1) Primeiro tenta enviar diretamente todas as partes da mensagem
+                    success, failed_index = self._send_multipart_dm(
+                        client,
+                        rest_username,
+                        next_phrase["text"],
+                        start_index=0,
+                    )
 
-                # Emite evento para frontend via websocket hub (database-api).
-                # A emissão real é feita em `_log_message`, que tenta enriquecer o evento.
+                    # Emite evento para frontend via websocket hub (database-api).
+                    # A emissão real é feita pela database-api ao receber o `_log_message`.
 
-                if not success:
-                    logger.warning(f"Falha ao enviar para @{rest_username}")
+                    if not success:
+                        logger.warning(f"Falha ao enviar para @{rest_username}")
 
-                self._log_message(rest_id, persona["id"], next_phrase["id"], success)
+                    self._log_message(rest_id, persona["id"], next_phrase["id"], success)
 
-            logger.info(f"Bloco {block_number} concluído!\n")
-            
-            # Fecha os drivers do bloco para liberar recursos
-            # (Os drivers serão recriados no próximo bloco se necessário)
-            for client in persona_clients.values():
-                try:
-                    client.quit()
-                except Exception as e:
-                    logger.debug(f"Erro ao fechar driver: {e}")
-            persona_clients.clear()
+                logger.info(f"Bloco {block_number} concluído!\n")
+            finally:
+                # Fecha os drivers do bloco para liberar recursos (inclusive em parada imediata)
+                # (Os drivers serão recriados no próximo bloco se necessário)
+                for client in persona_clients.values():
+                    try:
+                        client.quit()
+                    except Exception as e:
+                        logger.debug(f"Erro ao fechar driver: {e}")
+                persona_clients.clear()
 
         logger.info("Automação finalizada com sucesso!")
 
         # Registra fim do ciclo de automação
         if self.automation_run_id is not None:
             try:
-                requests.post(f"{self.db_url}/runs/{self.automation_run_id}/finish")
+                SESSION.post(f"{self.db_url}/runs/{self.automation_run_id}/finish")
             except Exception as e:
                 logger.warning(f"Falha ao registrar fim da automation run {self.automation_run_id}: {e}")
\ No newline at end of file
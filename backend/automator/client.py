@@ -1,3 +1,4 @@
+import atexit
 import time
 import logging
 import random
@@ -21,30 +22,31 @@ from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 
 try:
-    from ..logging_to_dbapi import DatabaseApiLogHandler
+    from ..logging_to_dbapi import queue_database_api_logging
 except Exception:
     try:
-        from .logging_to_dbapi import DatabaseApiLogHandler
+        from .logging_to_dbapi import queue_database_api_logging
     except Exception:
         try:
-            from automator.logging_to_dbapi import DatabaseApiLogHandler
+            from automator.logging_to_dbapi import queue_database_api_logging
         except Exception:
-            from logging_to_dbapi import DatabaseApiLogHandler
+            from logging_to_dbapi import queue_database_api_logging
 
 # Configure a module logger
 logger = logging.getLogger(__name__)
 
 # Ensure logs pass through DatabaseApiLogHandler so they are forwarded to the database-api.
+# The handler runs behind a queue, so Selenium steps never wait on the HTTP POST of a log line.
 try:
     if not logging.getLogger().handlers:
         logging.basicConfig(level=logging.INFO)
 
-    already = any(h.__class__.__name__ == "DatabaseApiLogHandler" for h in logger.handlers)
-    if not already:
-        db_handler = DatabaseApiLogHandler()
-        db_handler.setLevel(logging.INFO)
-        logger.addHandler(db_handler)
-        logger.propagate = False
+    _log_listener = queue_database_api_logging(logger, logging.INFO)
+    if _log_listener is not None:
+        _log_listener.start()
+        # Envia o último lote pendente ao encerrar o processo
+        atexit.register(_log_listener.stop)
+    logger.propagate = False
 except Exception:
     pass
 
@@ -0,0 +1,46 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class _IdempotentRetry(Retry):
+    """Retry que só repete os métodos de `allowed_methods` (por padrão, os idempotentes).
+
+    O Retry do urllib3 repete erros de conexão em qualquer método; aqui um POST falha
+    já na primeira tentativa em vez de ser reenviado.
+    """
+
+    def increment(self, method=None, *args, **kwargs):
+        if method is not None and self.allowed_methods is not None and method.upper() not in self.allowed_methods:
+            return Retry.increment(self.new(total=0), method, *args, **kwargs)
+        return super().increment(method, *args, **kwargs)
+
+
+def _build_session(retry: bool = True) -> requests.Session:
+    """Cria uma sessão HTTP para as chamadas síncronas à database-api.
+
+    O pool do urllib3 mantém as conexões keep-alive (sem novo DNS/TCP por chamada) e o
+    adapter repete GETs que falharem (erro de conexão ou 502/503/504). POSTs não são
+    repetidos (não são idempotentes), e a resposta final é sempre devolvida ao chamador.
+    Com `retry=False` nada é repetido.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=64,
+        max_retries=_IdempotentRetry(
+            total=2,
+            backoff_factor=0.1,
+            status_forcelist=[502, 503, 504],
+            raise_on_status=False,
+        ) if retry else 0,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+SESSION = _build_session()
+# Envio de logs: sem retries, para que uma database-api fora do ar não gere novos
+# registros de log (avisos de retry do urllib3) a cada POST de log que falha
+LOG_SESSION = _build_session(retry=False)
@@ -1,35 +1,145 @@
 import logging
-import requests
-from typing import Any
+import queue
+import threading
+import time
+from typing import Any, List, Optional
 
 from config import settings
 
+try:
+    from .http_session import LOG_SESSION
+except ImportError:
+    from http_session import LOG_SESSION
+
+# URLs resolvidas uma vez (o handler roda para cada linha de log)
+_LOGLINE_URL = f"{settings.DATABASE_API_URL.rstrip('/')}/automation/logline"
+_LOGLINE_BULK_URL = f"{_LOGLINE_URL}/bulk"
+
+# Marca de fim para a thread de envio
+_STOP = object()
+
+# Loggers dos clientes HTTP: o próprio envio de logs passa por eles, então seus registros
+# não voltam para a database-api (senão uma falha de envio vira mais logs para enviar)
+_HTTP_CLIENT_LOGGERS = ("urllib3", "requests", "httpx", "httpcore")
+
+
+class _SkipHttpClientLogs(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        name = record.name
+        return not any(name == prefix or name.startswith(prefix + ".") for prefix in _HTTP_CLIENT_LOGGERS)
+
 
 class DatabaseApiLogHandler(logging.Handler):
     """Logging handler that forwards formatted log records to the database-api
 
     The handler performs a best-effort POST to the configured
     `settings.DATABASE_API_URL/automation/logline` endpoint and never raises.
+    Depois de `start()`, `emit` só formata e enfileira: uma thread própria junta até
+    `max_batch` registros ou `max_wait` segundos e faz um único POST para
+    `/automation/logline/bulk`. `stop()` (ou `close()`) envia o que restou na fila.
     """
 
-    def emit(self, record: logging.LogRecord) -> None:
+    def __init__(self, level: int = logging.NOTSET, max_batch: int = 64, max_wait: float = 0.2):
+        super().__init__(level)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue: "queue.Queue[Any]" = queue.Queue(-1)
+        self._thread: Optional[threading.Thread] = None
+        self.addFilter(_SkipHttpClientLogs())
+
+    def _payload(self, record: logging.LogRecord) -> dict[str, Any]:
+        return {
+            "message": self.format(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "created_at": getattr(record, "created", None),
+        }
+
+    def _post(self, url: str, payload: Any) -> None:
         try:
-            message = self.format(record)
-            payload: dict[str, Any] = {
-                "message": message,
-                "level": record.levelname,
-                "logger": record.name,
-                "created_at": getattr(record, "created", None),
-            }
+            LOG_SESSION.post(url, json=payload, timeout=2)
+        except Exception:
+            # Best-effort: don't raise from the logging path
+            return
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._worker, name="dbapi-log", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join()
+        self._thread = None
+        # Registros enfileirados depois da marca de fim
+        leftover = []
+        while True:
             try:
-                requests.post(
-                    f"{settings.DATABASE_API_URL.rstrip('/')}/automation/logline",
-                    json=payload,
-                    timeout=2,
-                )
-            except Exception:
-                # Best-effort: don't raise from the logging path
-                return
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftover.append(item)
+        if leftover:
+            self._post(_LOGLINE_BULK_URL, leftover)
+
+    def close(self) -> None:
+        self.stop()
+        super().close()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            payload = self._payload(record)
         except Exception:
             # Protect logging from raising
             return
+        if self._thread is None:
+            # Sem thread de envio: POST direto, como antes
+            self._post(_LOGLINE_URL, payload)
+            return
+        self._queue.put(payload)
+
+    def _worker(self) -> None:
+        q = self._queue
+        while True:
+            item = q.get()
+            if item is _STOP:
+                return
+            batch: List[dict[str, Any]] = [item]
+            stopping = False
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = q.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._post(_LOGLINE_BULK_URL, batch)
+            if stopping:
+                return
+
+
+def queue_database_api_logging(logger: logging.Logger, level: int = logging.INFO) -> Optional[DatabaseApiLogHandler]:
+    """Anexa a `logger` um DatabaseApiLogHandler que envia os logs em lotes, em background.
+
+    A chamada de log só formata e enfileira; o POST para a database-api acontece na thread
+    do handler retornado (em lotes de até 64 registros / 200 ms), que o chamador deve
+    iniciar (`start()`) e parar (`stop()`).
+    Se o logger já tiver um DatabaseApiLogHandler, nada é anexado e o retorno é None
+    (quem anexou o handler existente é quem cuida da thread dele).
+    """
+    if any(isinstance(h, DatabaseApiLogHandler) for h in logger.handlers):
+        return None
+    db_handler = DatabaseApiLogHandler(level)
+    logger.addHandler(db_handler)
+    return db_handler
@@ -1,213 +1,288 @@
-from fastapi import FastAPI, BackgroundTasks, HTTPException, Request, UploadFile, File
+from fastapi import FastAPI, Request, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, Response, FileResponse
+from fastapi.responses import Response, FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
 
-import requests
+import asyncio
+import httpx
+import orjson
 import time
 import logging
+from contextlib import asynccontextmanager
 
 from datetime import datetime, timedelta, timezone
 
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Tuple, Union, Dict, Any
+from typing import Tuple, Union, Dict, Any, List, Callable, Iterable, Optional
 
-from automator.carousel import CarouselAutomator
+from automator.carousel import CarouselAutomator, AutomationStopped
 from config import settings
-from automator.logging_to_dbapi import DatabaseApiLogHandler
-from restaurant_processor import process_restaurants_excel, process_restaurants_csv, assign_blocks_to_restaurants
+from automator.logging_to_dbapi import queue_database_api_logging
+from restaurant_processor import (
+    process_restaurants_excel,
+    process_restaurants_csv,
+    assign_blocks_to_restaurants,
+    bloco_presence,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+BRT = timezone(timedelta(hours=-3))
+DATABASE_API_URL = settings.DATABASE_API_URL.rstrip("/")
 
-# Anexa o handler globalmente para todas as logs do backend (se ainda não anexado)
+# Anexa o handler globalmente para todas as logs do backend (se ainda não anexado).
+# O handler só enfileira o registro; o envio HTTP para a database-api acontece na
+# thread dele (iniciada no lifespan), fora dos handlers de request.
 root_logger = logging.getLogger()
-try:
-    already = any(h.__class__.__name__ == "DatabaseApiLogHandler" for h in root_logger.handlers)
-    if not already:
-        db_handler = DatabaseApiLogHandler()
-        db_handler.setLevel(logging.INFO)
-        root_logger.addHandler(db_handler)
-except Exception:
-    # Não falha a inicialização do app caso haja problema ao anexar o handler
-    pass
+log_listener = queue_database_api_logging(root_logger, logging.INFO)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Inicia/encerra a thread de logs e o client HTTP assíncrono compartilhado.
+
+    O `httpx.AsyncClient` mantém um pool de conexões keep-alive com a database-api,
+    reaproveitado pelo proxy e pelos endpoints bulk sem bloquear o event loop.
+    """
+    if log_listener is not None:
+        log_listener.start()
+    app.state.http = httpx.AsyncClient(
+        base_url=DATABASE_API_URL,
+        limits=httpx.Limits(max_keepalive_connections=100, max_connections=200),
+        timeout=30.0,
+    )
+    try:
+        yield
+    finally:
+        await _stop_automation_task()
+        await app.state.http.aclose()
+        if log_listener is not None:
+            log_listener.stop()
+
 
 app = FastAPI(
     title="Backend API - Instagram Automation",
     version="2.1.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
 
-# Variáveis globais para controle do loop
+# Variáveis globais para controle do loop.
+# O loop roda como asyncio.Task no event loop do app; cada ciclo do carrossel (Selenium,
+# bloqueante) roda em uma worker thread, que consulta stop_event nos checkpoints.
 stop_event = threading.Event()
-automation_thread = None
+automation_task: Optional[asyncio.Task] = None
+automation_cycle: Optional[asyncio.Future] = None  # ciclo em execução na worker thread
 
 
 # === PROXY CRUD para database-api ===
+_BODY_METHODS = ("POST", "PUT", "PATCH")
+# Headers hop-by-hop (RFC 7230 §6.1) + host: não são repassados para a database-api.
+# Nomes em bytes minúsculos, como chegam em `request.headers.raw` (ASGI).
+_HOP_HEADERS = frozenset({
+    b"host",
+    b"connection",
+    b"keep-alive",
+    b"proxy-authenticate",
+    b"proxy-authorization",
+    b"te",
+    b"trailer",
+    b"transfer-encoding",
+    b"upgrade",
+})
+# JSON enviado à database-api é serializado com orjson (bytes prontos em `content=`)
+_JSON_HEADERS = {"content-type": "application/json"}
+
+
+def _json_response(content: Any, status_code: int = 200) -> Response:
+    """Resposta JSON serializada com orjson (bytes direto no corpo)."""
+    return Response(content=orjson.dumps(content), status_code=status_code, media_type="application/json")
+
+
+def _relay_response(resp: httpx.Response) -> Response:
+    """Devolve a resposta da database-api ao frontend.
+
+    JSON é repassado byte a byte com o content-type original (sem decode + re-encode);
+    corpos que não são JSON continuam embrulhados em {"text": ...}.
+    """
+    # If upstream returned no content (e.g. 204 No Content), return an empty response with same status
+    if resp.status_code == 204 or not resp.content:
+        return Response(status_code=resp.status_code)
+
+    content_type = resp.headers.get("content-type", "")
+    if "application/json" in content_type:
+        return Response(content=resp.content, status_code=resp.status_code, media_type=content_type)
+
+    # Not JSON — return text body
+    return _json_response({"text": resp.text}, status_code=resp.status_code)
+
+
 @app.api_route("/proxy/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
 async def proxy(request: Request, path: str):
-    url = f"{settings.DATABASE_API_URL}/{path.lstrip('/')}"
+    url = f"/{path.lstrip('/')}"
     if request.query_params:
         url += f"?{request.query_params}"
+    # O corpo é repassado em streaming (chunks do cliente seguem direto para a database-api,
+    # sem bufferizar o upload inteiro). GET/DELETE não carregam corpo.
+    body = request.stream() if request.method in _BODY_METHODS else None
     try:
-        resp = requests.request(
-            method=request.method,
-            url=url,
-            headers={k: v for k, v in request.headers.items() if k.lower() != "host"},
-            data=await request.body(),
+        resp = await app.state.http.request(
+            request.method,
+            url,
+            headers=[(k, v) for k, v in request.headers.raw if k not in _HOP_HEADERS],
+            content=body,
             timeout=30,
         )
     except Exception as e:
-        return JSONResponse(content={"error": "upstream request failed", "detail": str(e)}, status_code=502)
-
-    # If upstream returned no content (e.g. 204 No Content), return an empty response with same status
-    if resp.status_code == 204 or not resp.content:
-        return Response(status_code=resp.status_code)
+        return _json_response({"error": "upstream request failed", "detail": str(e)}, status_code=502)
 
-    # Try to parse JSON; if body is not JSON, return plain text
-    try:
-        data = resp.json()
-    except ValueError:
-        # Not JSON — return text body
-        return JSONResponse(content={"text": resp.text}, status_code=resp.status_code)
+    # Escritas em config pelo proxy (ConfigTab) devem valer já no próximo ciclo
+    if request.method != "GET" and path.lstrip("/").startswith("config") and resp.is_success:
+        invalidate_config_cache()
 
-    return JSONResponse(content=data, status_code=resp.status_code)
+    return _relay_response(resp)
 
 
 @app.get("/reports/messages.xlsx")
 async def proxy_messages_report(request: Request):
     """Proxy para o relatório XLSX de mensagens na database-api.
 
-    Preserva o conteúdo XLSX para o frontend baixar diretamente.
+    Preserva o conteúdo XLSX para o frontend baixar diretamente. Os bytes são
+    repassados em streaming (chunks de 64 KB), sem bufferizar a planilha inteira.
     """
-    url = f"{settings.DATABASE_API_URL}/reports/messages.xlsx"
+    client: httpx.AsyncClient = app.state.http
     try:
-        resp = requests.get(url, params=dict(request.query_params), timeout=60)
+        upstream = await client.send(
+            client.build_request(
+                "GET", "/reports/messages.xlsx", params=dict(request.query_params), timeout=60
+            ),
+            stream=True,
+        )
     except Exception as e:
-        return JSONResponse(content={"error": "upstream request failed", "detail": str(e)}, status_code=502)
+        return _json_response({"error": "upstream request failed", "detail": str(e)}, status_code=502)
 
-    return Response(
-        content=resp.content,
-        media_type=resp.headers.get(
+    return StreamingResponse(
+        upstream.aiter_raw(65536),
+        media_type=upstream.headers.get(
             "content-type",
             "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         ),
-        status_code=resp.status_code,
+        status_code=upstream.status_code,
         headers={
-            "Content-Disposition": resp.headers.get(
+            "Content-Disposition": upstream.headers.get(
                 "content-disposition", "attachment; filename=messages_report.xlsx"
             )
         },
+        background=BackgroundTask(upstream.aclose),
     )
 
 
 # === Configuração dinâmica ===
-def get_rest_days() -> int:
-    """Busca rest_days em /config/ na database-api.
+# Cache curto de /config/: os valores mudam raramente, então a maioria dos ciclos
+# evita o round-trip. Escritas em config via backend zeram o timestamp (invalidate_config_cache).
+# Leitura e invalidação acontecem no event loop, então não há necessidade de lock.
+CONFIG_CACHE_TTL_SECONDS = 45
+_CONFIG_CACHE: Dict[str, Any] = {"t": 0.0, "v": None}
 
-    Usa valor padrão seguro (2) e garante mínimo de 1 dia.
-    """
-    default_days = 2
-    days = default_days
 
+def invalidate_config_cache() -> None:
+    _CONFIG_CACHE["t"] = 0.0
+
+
+def _config_int(cfg: Dict[str, Any], key: str, default: int) -> int:
+    """Extrai um inteiro de /config/ (valor direto ou {value, description})."""
+    raw = cfg.get(key)
+    if isinstance(raw, dict):
+        raw = raw.get("value")
     try:
-        r_cfg = requests.get(f"{settings.DATABASE_API_URL}/config/")
-        if r_cfg.status_code == 200:
-            cfg = r_cfg.json() or {}
-            if isinstance(cfg, dict) and "rest_days" in cfg:
-                raw = cfg["rest_days"]
-                if isinstance(raw, dict):
-                    raw = raw.get("value")
-                try:
-                    if raw is not None:
-                        days = int(raw)
-                except (TypeError, ValueError):
-                    pass
-    except Exception:
-        # Em caso de erro de rede/JSON, mantemos o default
+        if raw is not None:
+            return int(raw)
+    except (TypeError, ValueError):
         pass
-
-    if days < 1:
-        days = 1
-    return days
+    return default
 
 
-def get_wait_config() -> tuple[int, int]:
-    """Busca wait_min_seconds e wait_max_seconds na database-api.
+async def get_runtime_config() -> Tuple[int, int, int]:
+    """Busca rest_days, wait_min_seconds e wait_max_seconds com um único GET em /config/.
 
-    Garante defaults seguros (5, 15) e que min <= max.
+    Usa defaults seguros (2, 5, 15), garante mínimo de 1 dia / 1 segundo e min <= max.
+    O resultado fica em cache por CONFIG_CACHE_TTL_SECONDS.
     """
-    default_min, default_max = 5, 15
+    if (
+        _CONFIG_CACHE["v"] is not None
+        and time.monotonic() - _CONFIG_CACHE["t"] < CONFIG_CACHE_TTL_SECONDS
+    ):
+        return _CONFIG_CACHE["v"]
 
-    min_val = default_min
-    max_val = default_max
+    rest_days, min_val, max_val = 2, 5, 15
 
     try:
         # /config/ retorna um objeto chave -> {value, description}
-        r_cfg = requests.get(f"{settings.DATABASE_API_URL}/config/")
+        r_cfg = await app.state.http.get("/config/")
         if r_cfg.status_code == 200:
             cfg = r_cfg.json() or {}
             if isinstance(cfg, dict):
-                # wait_min_seconds
-                if "wait_min_seconds" in cfg:
-                    raw = cfg["wait_min_seconds"]
-                    if isinstance(raw, dict):
-                        raw = raw.get("value")
-                    try:
-                        if raw is not None:
-                            min_val = int(raw)
-                    except (TypeError, ValueError):
-                        pass
-
-                # wait_max_seconds
-                if "wait_max_seconds" in cfg:
-                    raw = cfg["wait_max_seconds"]
-                    if isinstance(raw, dict):
-                        raw = raw.get("value")
-                    try:
-                        if raw is not None:
-                            max_val = int(raw)
-                    except (TypeError, ValueError):
-                        pass
+                rest_days = _config_int(cfg, "rest_days", rest_days)
+                min_val = _config_int(cfg, "wait_min_seconds", min_val)
+                max_val = _config_int(cfg, "wait_max_seconds", max_val)
     except Exception:
         # Em caso de erro de rede ou JSON, mantemos os defaults
         pass
 
     # Sanitização básica
+    if rest_days < 1:
+        rest_days = 1
     if min_val < 1:
         min_val = 1
     if max_val < min_val:
         max_val = min_val
 
-    return min_val, max_val
+    result = (rest_days, min_val, max_val)
+    _CONFIG_CACHE["v"] = result
+    _CONFIG_CACHE["t"] = time.monotonic()
+    return result
 
 
 # === Loop Infinito com Descanso Individual ===
-def run_forever():
+async def run_forever():
+    global automation_cycle
     cycle = 0
-    BRT = timezone(timedelta(hours=-3))
 
     while not stop_event.is_set():
         cycle += 1
-        stop_event.clear()  # garante que não pare no meio do ciclo
-        start = datetime.now(BRT)
+        start = time.monotonic()
         logger.info(f"══════ CICLO {cycle} INICIADO ══════")
 
         try:
-            rest_days = get_rest_days()
-            wait_min, wait_max = get_wait_config()
+            rest_days, wait_min, wait_max = await get_runtime_config()
             automator = CarouselAutomator(
                 rest_days=rest_days,
                 wait_min_seconds=wait_min,
                 wait_max_seconds=wait_max,
+                stop_event=stop_event,
             )
-            automator.run()  # ← agora recebe o parâmetro de descanso
+            # Selenium é bloqueante: o ciclo roda em uma worker thread. O shield mantém
+            # o future vivo se a task for cancelada, para sabermos quando a thread terminou.
+            automation_cycle = asyncio.ensure_future(asyncio.to_thread(automator.run))
+            await asyncio.shield(automation_cycle)
+        except asyncio.CancelledError:
+            # Cancelamento da task (/stop-immediate ou shutdown): o ciclo em andamento
+            # termina no próximo checkpoint do carrossel.
+            stop_event.set()
+            if automation_cycle is not None:
+                # Consome o resultado (AutomationStopped) quando a thread terminar
+                automation_cycle.add_done_callback(lambda f: f.cancelled() or f.exception())
+            logger.warning(f"Ciclo {cycle} interrompido por parada imediata.")
+            raise
+        except AutomationStopped:
+            logger.warning(f"Ciclo {cycle} interrompido por parada imediata.")
         except Exception as e:
             logger.error(f"Erro crítico no ciclo {cycle}: {e}", exc_info=True)
 
-        end = datetime.now(BRT)
-        logger.info(f"══════ CICLO {cycle} FINALIZADO ══════ {end.strftime('%H:%M:%S')} | Duração: {(end-start).seconds}s")
+        duration = time.monotonic() - start
+        logger.info(f"══════ CICLO {cycle} FINALIZADO ══════ {datetime.now(BRT).strftime('%H:%M:%S')} | Duração: {duration:.0f}s")
 
         if stop_event.is_set():
             logger.info("Comando de parada recebido. Encerrando após ciclo completo.")
@@ -217,65 +292,55 @@ def run_forever():
 
 
 # === Rotas de Controle ===
+def _automation_running() -> bool:
+    if automation_task is not None and not automation_task.done():
+        return True
+    # Após um cancelamento, a worker thread pode ainda estar indo até o próximo checkpoint
+    return automation_cycle is not None and not automation_cycle.done()
+
+
+async def _stop_automation_task() -> None:
+    """Sinaliza a parada e cancela a task do loop (o ciclo encerra no próximo checkpoint)."""
+    stop_event.set()
+    if automation_task is not None and not automation_task.done():
+        automation_task.cancel()
+        try:
+            await automation_task
+        except asyncio.CancelledError:
+            pass
+
+
 @app.post("/start/")
-def start_automation(background_tasks: BackgroundTasks):
-    global automation_thread
-    if automation_thread and automation_thread.is_alive():
+async def start_automation():
+    global automation_task
+    if _automation_running():
         return {"status": "Já está rodando!"}
 
     stop_event.clear()
-    automation_thread = threading.Thread(target=run_forever, daemon=True)
-    automation_thread.start()
+    automation_task = asyncio.create_task(run_forever())
     return {"status": "Automação iniciada em loop infinito", "dica": "Use POST /stop/ para parar"}
 
 
 @app.post("/stop-immediate/")
-def stop_immediate():
+async def stop_immediate():
     """Para imediatamente a execução, mesmo no meio de um ciclo."""
-    if not automation_thread or not automation_thread.is_alive():
+    if not _automation_running():
         return {"status": "Nenhum loop ativo"}
 
-    logger.warning("Comando /stop-immediate recebido → parando execução IMEDIATAMENTE")
-    
-    # Sinaliza para parar
-    stop_event.set()
-    
-    # Tenta encerrar a thread imediatamente
-    try:
-        # Isso pode causar problemas se a thread estiver em operação crítica
-        # mas é o que precisamos para parar imediatamente
-        if automation_thread.is_alive():
-            import ctypes
-            import inspect
-            
-            # Obtém o ID da thread
-            thread_id = automation_thread.ident
-            
-            # Envia uma exceção para a thread para forçar a parada
-            res = ctypes.pythonapi.PyThreadState_SetAsyncExc(
-                ctypes.c_long(thread_id),
-                ctypes.py_object(SystemExit)
-            )
-            
-            if res == 0:
-                logger.error("Falha ao interromper a thread: thread não encontrada")
-            elif res > 1:
-                # Se retornar > 1, precisamos chamar novamente para restaurar o estado
-                ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_long(thread_id), None)
-                logger.warning("Thread interrompida com sucesso (forçado)")
-            
-    except Exception as e:
-        logger.error(f"Erro ao tentar parar a thread: {e}")
-        return {"status": "erro", "detail": f"Erro ao parar a thread: {str(e)}"}
-    
-    return {"status": "Parada imediata solicitada", "detail": "A execução foi interrompida imediatamente"}
+    logger.warning("Comando /stop-immediate recebido → parando execução no próximo checkpoint")
+
+    # Parada cooperativa: a task é cancelada e o carrossel verifica stop_event entre restaurantes
+    # e durante as esperas (stop_event.wait), encerrando o ciclo sem deixar locks/drivers em estado inválido.
+    await _stop_automation_task()
+
+    return {"status": "Parada imediata solicitada", "detail": "A execução será interrompida no próximo checkpoint"}
 
 
 @app.get("/")
 def health():
     return {
         "status": "Backend ativo",
-        "loop_running": automation_thread.is_alive() if automation_thread else False,
+        "loop_running": _automation_running(),
         "controles": {
             "iniciar": "POST /start/",
             "parar": "POST /stop/",
@@ -292,42 +357,120 @@ async def set_config_bulk(request: Request):
     Accepts JSON object mapping keys to either a string value or an object {value, description}.
     """
     try:
-        payload = await request.json()
+        payload = orjson.loads(await request.body())
     except Exception as e:
-        return JSONResponse({"error": "invalid json", "detail": str(e)}, status_code=400)
+        return _json_response({"error": "invalid json", "detail": str(e)}, status_code=400)
 
     try:
-        resp = requests.post(f"{settings.DATABASE_API_URL}/config/bulk", json=payload, timeout=15)
+        resp = await app.state.http.post(
+            "/config/bulk", content=orjson.dumps(payload), headers=_JSON_HEADERS, timeout=15
+        )
     except Exception as e:
-        return JSONResponse({"error": "upstream request failed", "detail": str(e)}, status_code=502)
+        return _json_response({"error": "upstream request failed", "detail": str(e)}, status_code=502)
 
-    if resp.status_code == 204 or not resp.content:
-        return Response(status_code=resp.status_code)
+    if resp.is_success:
+        invalidate_config_cache()
 
-    try:
-        data = resp.json()
-    except ValueError:
-        return JSONResponse({"text": resp.text}, status_code=resp.status_code)
+    return _relay_response(resp)
 
-    return JSONResponse(content=data, status_code=resp.status_code)
+
+@app.post("/config/invalidate")
+def invalidate_config():
+    """Descarta o cache de /config/ para que o próximo ciclo releia os valores."""
+    invalidate_config_cache()
+    return {"status": "invalidated"}
 
 
 # === Bulk endpoints (frontend chama aqui; este backend chama a database-api em paralelo) ===
 
-def _post_to_database(path: str, json_body: Dict[str, Any], timeout: float = 15.0) -> Tuple[int, Union[Dict[str, Any], str]]:
-    """Helper síncrono para POST na database-api, retornando (status_code, body/json ou texto)."""
-    url = f"{settings.DATABASE_API_URL}/{path.lstrip('/') }"
-    try:
-        resp = requests.post(url, json=json_body, timeout=timeout)
-    except Exception as e:
-        return 502, {"error": "upstream request failed", "detail": str(e)}
+BULK_BATCH_SIZE = 100  # Itens por POST na database-api
+BULK_MAX_CONCURRENCY = 8  # Batches simultâneos por request (limita a carga na database-api)
+
 
+async def _post_batch(client: httpx.AsyncClient, path: str, batch: List[Any]) -> Tuple[int, Union[Dict[str, Any], str]]:
+    """POST de um batch na database-api, retornando (status_code, json ou texto)."""
+    resp = await client.post(
+        path, content=orjson.dumps(batch), headers=_JSON_HEADERS, timeout=60  # Timeout maior para batches
+    )
     try:
-        return resp.status_code, resp.json()
+        return resp.status_code, orjson.loads(resp.content)
     except ValueError:
         return resp.status_code, resp.text
 
 
+async def _bulk_forward(path: str, payload: List[Any], keys: Callable[[Any], Iterable[Any]]) -> Dict[str, Any]:
+    """Envia `payload` para `path` em batches de BULK_BATCH_SIZE, em paralelo.
+
+    Como os batches não rodam mais em sequência, itens repetidos em batches diferentes
+    são descartados aqui (contados como `skipped`), usando as chaves únicas de `keys(item)`;
+    assim dois batches concorrentes nunca disputam a mesma chave na database-api.
+    """
+    seen: set = set()
+    unique: List[Any] = []
+    skipped = 0
+    for item in payload:
+        # Chaves são namespaced pela posição (ex.: persona -> (nome, username))
+        item_keys = [(n, k) for n, k in enumerate(keys(item) if isinstance(item, dict) else ()) if k]
+        if any(k in seen for k in item_keys):
+            skipped += 1
+            continue
+        seen.update(item_keys)
+        unique.append(item)
+
+    client = app.state.http
+    sem = asyncio.Semaphore(BULK_MAX_CONCURRENCY)
+    starts = range(0, len(unique), BULK_BATCH_SIZE)
+
+    async def _bounded(start: int):
+        async with sem:
+            return await _post_batch(client, path, unique[start:start + BULK_BATCH_SIZE])
+
+    results = await asyncio.gather(*(_bounded(i) for i in starts), return_exceptions=True)
+
+    all_created = []
+    errors = []
+    for i, result in zip(starts, results):
+        batch_end = min(i + BULK_BATCH_SIZE, len(unique))
+        if isinstance(result, Exception):
+            errors.append({"batch_start": i, "batch_end": batch_end, "error": str(result)})
+            continue
+        status, body = result
+        if status == 201 and isinstance(body, dict):
+            all_created.extend(body.get("created_items", []))
+            skipped += body.get("skipped", 0)
+        else:
+            errors.append({"batch_start": i, "batch_end": batch_end, "status": status, "detail": body})
+
+    return {
+        "created": len(all_created),
+        "skipped": skipped,
+        "created_items": all_created,
+        "errors": errors
+    }
+
+
+def _strip_at(value: Any) -> str:
+    username = str(value or "").strip()
+    return username[1:] if username.startswith("@") else username
+
+
+# Chaves únicas usadas pela database-api para descartar duplicatas em cada entidade
+def _restaurant_keys(r: Dict[str, Any]) -> Tuple[str]:
+    return (_strip_at(str(r.get("instagram_username") or "").lower()),)
+
+
+def _persona_keys(p: Dict[str, Any]) -> Tuple[str, str]:
+    # O nome vai sem normalização: PersonaCreate não o altera, e o UNIQUE compara o valor cru
+    return (str(p.get("name") or ""), _strip_at(p.get("instagram_username")))
+
+
+def _phrase_keys(p: Dict[str, Any]) -> Tuple[Tuple[str, Any]]:
+    return ((str(p.get("text") or "").strip().lower(), p.get("order")),)
+
+
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MB por leitura do UploadFile
+
+
 @app.post("/restaurants/process-excel")
 async def process_restaurants_excel_endpoint(file: UploadFile = File(...)):
     """
@@ -344,24 +487,25 @@ async def process_restaurants_excel_endpoint(file: UploadFile = File(...)):
     from pathlib import Path
     
     if not file.filename.lower().endswith((".xlsx", ".xls", ".csv")):
-        return JSONResponse(
+        return _json_response(
             {"error": "Arquivo deve ser Excel (.xlsx/.xls) ou CSV (.csv)"}, 
             status_code=400
         )
     
-    # Salva arquivo temporário
+    # Salva arquivo temporário em chunks de 1 MB (memória O(chunk), escrita fora do event loop)
     suffix = ".csv" if file.filename.lower().endswith(".csv") else ".xlsx"
     with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_input:
-        content = await file.read()
-        tmp_input.write(content)
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await run_in_threadpool(tmp_input.write, chunk)
         tmp_input_path = tmp_input.name
     
     try:
-        # Processa o arquivo
+        # Processa o arquivo (leitura/escrita de planilhas e clustering são síncronos:
+        # roda no threadpool para não travar o proxy e os demais endpoints)
         if file.filename.lower().endswith(".csv"):
-            result = process_restaurants_csv(tmp_input_path)
+            result = await run_in_threadpool(process_restaurants_csv, tmp_input_path)
         else:
-            result = process_restaurants_excel(tmp_input_path)
+            result = await run_in_threadpool(process_restaurants_excel, tmp_input_path)
         output_path = result['output_file']
         
         # Retorna o arquivo processado
@@ -375,7 +519,7 @@ async def process_restaurants_excel_endpoint(file: UploadFile = File(...)):
         )
     except Exception as e:
         logger.error(f"Erro ao processar Excel: {e}", exc_info=True)
-        return JSONResponse(
+        return _json_response(
             {"error": "Erro ao processar arquivo", "detail": str(e)}, 
             status_code=500
         )
@@ -396,43 +540,31 @@ async def bulk_create_restaurants(request: Request):
     - Se alguns tiverem blocos e outros não, atribui apenas aos que não têm
     - Sempre usa a lógica de agrupamento para garantir que clusters sejam separados em blocos distintos
     
-    Processa em lotes de 100 restaurantes por vez para evitar sobrecarga do banco de dados.
+    Processa em lotes de 100 restaurantes, com até BULK_MAX_CONCURRENCY lotes em paralelo.
     """
     try:
-        payload = await request.json()
+        payload = orjson.loads(await request.body())
     except Exception as e:
-        return JSONResponse({"error": "invalid json", "detail": str(e)}, status_code=400)
+        return _json_response({"error": "invalid json", "detail": str(e)}, status_code=400)
 
     if not isinstance(payload, list):
-        return JSONResponse({"error": "payload must be a JSON array"}, status_code=400)
+        return _json_response({"error": "payload must be a JSON array"}, status_code=400)
 
     if not payload:
         return {"created": 0, "skipped": 0, "created_items": [], "errors": []}
 
-    # Verifica se os restaurantes têm blocos atribuídos
-    has_blocks = any(
-        r.get("bloco") is not None and r.get("bloco") != "" 
-        for r in payload 
-        if isinstance(r, dict)
-    )
+    # Verifica (vetorizado) se há restaurantes com e sem bloco atribuído
+    _, any_missing = bloco_presence(payload)
     
     # Se não tiverem blocos ou se alguns não tiverem, atribui automaticamente
-    if not has_blocks or any(
-        r.get("bloco") is None or r.get("bloco") == "" 
-        for r in payload 
-        if isinstance(r, dict)
-    ):
+    if any_missing:
         try:
             logger.info(f"Atribuindo blocos automaticamente a {len(payload)} restaurantes...")
             # Busca o maior bloco existente no banco para continuar a numeração
             try:
-                resp_existing = requests.get(f"{settings.DATABASE_API_URL}/restaurants/", timeout=10)
+                resp_existing = await app.state.http.get("/restaurants/max_bloco", timeout=5)
                 if resp_existing.status_code == 200:
-                    existing_restaurants = resp_existing.json()
-                    max_existing_bloco = max(
-                        (r.get("bloco", 0) or 0 for r in existing_restaurants if r.get("bloco")),
-                        default=0
-                    )
+                    max_existing_bloco = int(resp_existing.json().get("max") or 0)
                     start_block_num = max_existing_bloco + 1
                 else:
                     start_block_num = 1
@@ -440,171 +572,66 @@ async def bulk_create_restaurants(request: Request):
                 logger.warning(f"Erro ao buscar restaurantes existentes para determinar bloco inicial: {e}")
                 start_block_num = 1
             
-            # Atribui blocos usando a lógica de agrupamento
-            payload = assign_blocks_to_restaurants(payload, start_block_num=start_block_num)
+            # Atribui blocos usando a lógica de agrupamento (CPU-bound: fora do event loop)
+            payload = await run_in_threadpool(
+                assign_blocks_to_restaurants, payload, start_block_num=start_block_num
+            )
             logger.info(f"Blocos atribuídos automaticamente. Maior bloco: {max((r.get('bloco', 0) or 0) for r in payload) if payload else 0}")
         except Exception as e:
             logger.error(f"Erro ao atribuir blocos automaticamente: {e}", exc_info=True)
             # Continua mesmo se falhar a atribuição de blocos (não bloqueia o processo)
 
-    BATCH_SIZE = 100  # Processa 100 restaurantes por vez
-    all_created = []
-    all_skipped = 0
-    errors = []
-
-    # Processa em batches
-    for i in range(0, len(payload), BATCH_SIZE):
-        batch = payload[i:i + BATCH_SIZE]
-        try:
-            url = f"{settings.DATABASE_API_URL}/restaurants/bulk"
-            resp = requests.post(url, json=batch, timeout=60)  # Timeout maior para batches
-            
-            if resp.status_code == 201:
-                result = resp.json()
-                all_created.extend(result.get("created_items", []))
-                all_skipped += result.get("skipped", 0)
-            else:
-                # Se o batch falhar, tenta processar item por item para identificar erros específicos
-                try:
-                    error_detail = resp.json()
-                except:
-                    error_detail = resp.text
-                errors.append({
-                    "batch_start": i,
-                    "batch_end": min(i + BATCH_SIZE, len(payload)),
-                    "status": resp.status_code,
-                    "detail": error_detail
-                })
-        except Exception as e:
-            errors.append({
-                "batch_start": i,
-                "batch_end": min(i + BATCH_SIZE, len(payload)),
-                "error": str(e)
-            })
-
-    return {
-        "created": len(all_created),
-        "skipped": all_skipped,
-        "created_items": all_created,
-        "errors": errors
-    }
+    return _json_response(await _bulk_forward("/restaurants/bulk", payload, keys=_restaurant_keys))
 
 
 @app.post("/personas/bulk")
 async def bulk_create_personas(request: Request):
     """Recebe uma lista de personas e cria em batches usando o endpoint bulk da database-api.
 
-    Processa em lotes de 100 personas por vez para evitar sobrecarga do banco de dados.
+    Processa em lotes de 100 personas, com até BULK_MAX_CONCURRENCY lotes em paralelo.
     """
     try:
-        payload = await request.json()
+        payload = orjson.loads(await request.body())
     except Exception as e:
-        return JSONResponse({"error": "invalid json", "detail": str(e)}, status_code=400)
+        return _json_response({"error": "invalid json", "detail": str(e)}, status_code=400)
 
     if not isinstance(payload, list):
-        return JSONResponse({"error": "payload must be a JSON array"}, status_code=400)
+        return _json_response({"error": "payload must be a JSON array"}, status_code=400)
 
     if not payload:
         return {"created": 0, "skipped": 0, "created_items": [], "errors": []}
 
-    BATCH_SIZE = 100  # Processa 100 personas por vez
-    all_created = []
-    all_skipped = 0
-    errors = []
-
-    # Processa em batches
-    for i in range(0, len(payload), BATCH_SIZE):
-        batch = payload[i:i + BATCH_SIZE]
-        try:
-            url = f"{settings.DATABASE_API_URL}/personas/bulk"
-            resp = requests.post(url, json=batch, timeout=60)  # Timeout maior para batches
-            
-            if resp.status_code == 201:
-                result = resp.json()
-                all_created.extend(result.get("created_items", []))
-                all_skipped += result.get("skipped", 0)
-            else:
-                # Se o batch falhar, registra o erro
-                try:
-                    error_detail = resp.json()
-                except:
-                    error_detail = resp.text
-                errors.append({
-                    "batch_start": i,
-                    "batch_end": min(i + BATCH_SIZE, len(payload)),
-                    "status": resp.status_code,
-                    "detail": error_detail
-                })
-        except Exception as e:
-            errors.append({
-                "batch_start": i,
-                "batch_end": min(i + BATCH_SIZE, len(payload)),
-                "error": str(e)
-            })
-
-    return {
-        "created": len(all_created),
-        "skipped": all_skipped,
-        "created_items": all_created,
-        "errors": errors
-    }
+    return _json_response(await _bulk_forward("/personas/bulk", payload, keys=_persona_keys))
 
 
 @app.post("/phrases/bulk")
 async def bulk_create_phrases(request: Request):
     """Recebe uma lista de frases e cria em batches usando o endpoint bulk da database-api.
 
-    Processa em lotes de 100 frases por vez para evitar sobrecarga do banco de dados.
+    Processa em lotes de 100 frases, com até BULK_MAX_CONCURRENCY lotes em paralelo.
     """
     try:
-        payload = await request.json()
+        payload = orjson.loads(await request.body())
     except Exception as e:
-        return JSONResponse({"error": "invalid json", "detail": str(e)}, status_code=400)
+        return _json_response({"error": "invalid json", "detail": str(e)}, status_code=400)
 
     if not isinstance(payload, list):
-        return JSONResponse({"error": "payload must be a JSON array"}, status_code=400)
+        return _json_response({"error": "payload must be a JSON array"}, status_code=400)
 
     if not payload:
         return {"created": 0, "skipped": 0, "created_items": [], "errors": []}
 
-    BATCH_SIZE = 100  # Processa 100 frases por vez
-    all_created = []
-    all_skipped = 0
-    errors = []
+    return _json_response(await _bulk_forward("/phrases/bulk", payload, keys=_phrase_keys))
 
-    # Processa em batches
-    for i in range(0, len(payload), BATCH_SIZE):
-        batch = payload[i:i + BATCH_SIZE]
-        try:
-            url = f"{settings.DATABASE_API_URL}/phrases/bulk"
-            resp = requests.post(url, json=batch, timeout=60)  # Timeout maior para batches
-            
-            if resp.status_code == 201:
-                result = resp.json()
-                all_created.extend(result.get("created_items", []))
-                all_skipped += result.get("skipped", 0)
-            else:
-                # Se o batch falhar, registra o erro
-                try:
-                    error_detail = resp.json()
-                except:
-                    error_detail = resp.text
-                errors.append({
-                    "batch_start": i,
-                    "batch_end": min(i + BATCH_SIZE, len(payload)),
-                    "status": resp.status_code,
-                    "detail": error_detail
-                })
-        except Exception as e:
-            errors.append({
-                "batch_start": i,
-                "batch_end": min(i + BATCH_SIZE, len(payload)),
-                "error": str(e)
-            })
+if __name__ == "__main__":
+    import uvicorn
 
-    return {
-        "created": len(all_created),
-        "skipped": all_skipped,
-        "created_items": all_created,
-        "errors": errors
-    }
\ No newline at end of file
+    # uvloop (loop em libuv) + httptools (parser HTTP em C), ambos vêm com uvicorn[standard].
+    # uvloop não existe no Windows: nesse caso fica o loop padrão do asyncio.
+    try:
+        import uvloop  # noqa: F401
+        event_loop = "uvloop"
+    except ImportError:
+        event_loop = "asyncio"
+
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, loop=event_loop, http="httptools")
@@ -8,26 +8,112 @@ Implementa as regras estritas de:
 - Auditoria completa e rastreável
 """
 
+import os
 import re
+import sys
+import heapq
+import math
 import logging
+import multiprocessing
 from typing import List, Dict, Any, Tuple, Optional, Set
+from array import array
 from collections import defaultdict
-from difflib import SequenceMatcher
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+import numpy as np
 import pandas as pd
 from pathlib import Path
 import csv
 import unicodedata
+import xlsxwriter
+
+try:
+    from rapidfuzz.fuzz import ratio as _fuzz_ratio
+    from rapidfuzz.process import cdist as _cdist
+except ImportError:  # rapidfuzz ausente: cai no difflib (mesma escala, bem mais lento)
+    from difflib import SequenceMatcher
+    
+    _cdist = None
+
+    def _fuzz_ratio(s1: str, s2: str, score_cutoff: float = 0.0) -> float:
+        score = SequenceMatcher(None, s1, s2).ratio() * 100.0
+        return score if score >= score_cutoff else 0.0
+
+try:
+    import python_calamine  # noqa: F401  (engine="calamine" do pandas)
+    _HAS_CALAMINE = True
+except ImportError:
+    _HAS_CALAMINE = False
 
 logger = logging.getLogger(__name__)
 
+# As mesmas strings são normalizadas na deduplicação, no agrupamento e na auditoria;
+# os normalizadores memorizam o resultado por valor bruto (limite evita crescer sem fim no servidor).
+NORMALIZE_CACHE_SIZE = 65536
+
+# Padrões compilados uma única vez (usados por registro em todas as etapas)
+_RE_WHITESPACE = re.compile(r"\s+")
+_RE_NON_WORD = re.compile(r"[^\w\s]")
+_RE_PROTOCOL = re.compile(r"^https?://")
+_RE_WWW_INSTAGRAM = re.compile(r"^www\.instagram\.com/")
+_RE_INSTAGRAM = re.compile(r"^instagram\.com/")
+_RE_AT = re.compile(r"^@")
+_RE_DIGIT = re.compile(r"\d")
+_RE_CEP = re.compile(r"\b(\d{5}-?\d{3})\b")
+_RE_ADDRESS_NUMBER = re.compile(r"\b(\d{1,6}[a-z]?)\b", re.IGNORECASE)
+_RE_NO_NUMBER = re.compile(r"\bs/n\b|\bsem\s+n[úu]mero\b", re.IGNORECASE)
+
+# Tipos de via -> abreviação. Três passadas em vez de uma por tipo: "av." cola a palavra
+# seguinte ("av.rodovia" -> "avrodovia"), então precisa rodar depois de rua/avenida e antes do resto.
+_STREET_TYPES = {
+    'rua': 'r',
+    'avenida': 'av',
+    'av.': 'av',
+    'alameda': 'al',
+    'rodovia': 'rod',
+    'estrada': 'est',
+    'praça': 'pc',
+    'travessa': 'tv',
+    'largo': 'lg',
+    'via': 'v',
+    'passagem': 'psg',
+}
+_STREET_TYPE_PASSES = [
+    re.compile(r"\b(" + "|".join(re.escape(t) for t in types) + r")\b", re.IGNORECASE)
+    for types in (
+        ('rua', 'avenida'),
+        ('av.',),
+        ('alameda', 'rodovia', 'estrada', 'praça', 'travessa', 'largo', 'via', 'passagem'),
+    )
+]
+
+
+def _abbreviate_street_type(match: re.Match) -> str:
+    return _STREET_TYPES[match.group(1).lower()]
+
+def _strip_accents(text: str) -> str:
+    return "".join(ch for ch in unicodedata.normalize("NFKD", text) if not unicodedata.combining(ch))
+
+# Acentos do português (texto já em minúsculas) -> letra base, derivados do próprio NFKD
+_ACCENT_TABLE = str.maketrans({ch: _strip_accents(ch) for ch in "áàâãäéèêëíìîïóòôõöúùûüçñ"})
+
 def _norm_text(s: str) -> str:
     if s is None:
         return ""
-    s = str(s)
+    return _norm_text_cached(str(s))
+
+@lru_cache(maxsize=4096)
+def _norm_text_cached(s: str) -> str:
+    # Headers e banners se repetem entre arquivos; texto ASCII não tem acento para remover
     s = s.strip().lower()
-    s = unicodedata.normalize("NFKD", s)
-    s = "".join(ch for ch in s if not unicodedata.combining(ch))
-    s = re.sub(r"\s+", " ", s)
+    if not s.isascii():
+        # Tabela resolve o caso comum em uma passada em C; NFKD só para o que sobrar
+        s = s.translate(_ACCENT_TABLE)
+        if not s.isascii():
+            s = _strip_accents(s)
+    s = _RE_WHITESPACE.sub(" ", s)
     return s
 
 def _banner_forward_fill(row: List[str], target_len: int) -> List[str]:
@@ -128,15 +214,19 @@ def load_restaurants_template_csv(input_path: str) -> Tuple[pd.DataFrame, List[s
 
     internal_cols, internal_to_original = _build_internal_columns(headers)
 
-    # Lê dados (pulando 2 primeiras linhas: banner + header). engine=python para tolerar quebras de linha dentro de aspas.
+    # Lê dados (pulando 2 primeiras linhas: banner + header). O parser em C já aceita quebras de
+    # linha dentro de aspas; na_filter=False mantém células vazias como "" sem checar sentinelas de NA.
     df = pd.read_csv(
         input_path,
         skiprows=2,  # Pula banner (linha 1) e header será usado via names
         header=None,
         names=internal_cols,
-        engine="python",
+        engine="c",
+        quoting=csv.QUOTE_MINIMAL,
         dtype=str,
-        keep_default_na=False,
+        na_filter=False,
+        low_memory=False,
+        memory_map=True,  # parser lê direto do mapeamento do arquivo, sem cópias de buffer
         encoding="utf-8-sig",
     )
 
@@ -153,15 +243,19 @@ def normalize_instagram(instagram: str) -> str:
     """
     if not instagram or not isinstance(instagram, str):
         return ""
-    
+    return _normalize_instagram_cached(instagram)
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _normalize_instagram_cached(instagram: str) -> str:
     # Remove espaços e converte para minúsculas
     normalized = instagram.strip().lower()
     
     # Remove protocolos e domínios
-    normalized = re.sub(r'^https?://', '', normalized)
-    normalized = re.sub(r'^www\.instagram\.com/', '', normalized)
-    normalized = re.sub(r'^instagram\.com/', '', normalized)
-    normalized = re.sub(r'^@', '', normalized)
+    normalized = _RE_PROTOCOL.sub('', normalized)
+    normalized = _RE_WWW_INSTAGRAM.sub('', normalized)
+    normalized = _RE_INSTAGRAM.sub('', normalized)
+    normalized = _RE_AT.sub('', normalized)
     
     # Remove parênteses abertos e fechados, mantendo apenas o conteúdo
     normalized = normalized.replace('(', '').replace(')', '')
@@ -182,31 +276,21 @@ def normalize_address_street(street: str) -> str:
     """
     if not street or not isinstance(street, str):
         return ""
-    
+    return _normalize_address_street_cached(street)
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _normalize_address_street_cached(street: str) -> str:
     # Remove acentos (simplificado)
     normalized = street.strip().lower()
     
     # Normaliza tipos de via
-    replacements = {
-        r'\brua\b': 'r',
-        r'\bavenida\b': 'av',
-        r'\bav\.\b': 'av',
-        r'\balameda\b': 'al',
-        r'\brodovia\b': 'rod',
-        r'\bestrada\b': 'est',
-        r'\bpraça\b': 'pc',
-        r'\btravessa\b': 'tv',
-        r'\blargo\b': 'lg',
-        r'\bvia\b': 'v',
-        r'\bpassagem\b': 'psg',
-    }
-    
-    for pattern, replacement in replacements.items():
-        normalized = re.sub(pattern, replacement, normalized, flags=re.IGNORECASE)
+    for pattern in _STREET_TYPE_PASSES:
+        normalized = pattern.sub(_abbreviate_street_type, normalized)
     
     # Remove caracteres especiais e espaços extras
-    normalized = re.sub(r'[^\w\s]', '', normalized)
-    normalized = re.sub(r'\s+', ' ', normalized)
+    normalized = _RE_NON_WORD.sub('', normalized)
+    normalized = _RE_WHITESPACE.sub(' ', normalized)
     
     return normalized.strip()
 
@@ -219,24 +303,33 @@ def extract_address_number(address: str) -> Optional[str]:
     """
     if not address or not isinstance(address, str):
         return None
+    return _extract_address_number_cached(address)
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _extract_address_number_cached(address: str) -> Optional[str]:
+    # Sem nenhum dígito não há número (caso comum de "S/N" ou só o logradouro): evita o
+    # sub do CEP e as buscas abaixo
+    if not _RE_DIGIT.search(address):
+        return None
     
     # Primeiro tenta encontrar número simples (antes do CEP ou no início)
     # Padrão: número pode estar no formato "123", "123A", "123-A"
     # CEP geralmente está no final: "12345-678" ou "12345678"
     
     # Remove CEP do final para não confundir
-    address_clean = re.sub(r'\b\d{5}-?\d{3}\b', '', address)
+    address_clean = _RE_CEP.sub('', address)
     
     # Procura número no endereço (não CEP)
-    match = re.search(r'\b(\d{1,6}[a-z]?)\b', address_clean, re.IGNORECASE)
+    match = _RE_ADDRESS_NUMBER.search(address_clean)
     if match:
         number = match.group(1).upper()
         # Verifica se não é "S/N" ou "sem número"
-        if not re.search(r'\bs/n\b|\bsem\s+n[úu]mero\b', address, re.IGNORECASE):
+        if not _RE_NO_NUMBER.search(address):
             return number
     
     # Verifica se é "S/N" ou "sem número"
-    if re.search(r'\bs/n\b|\bsem\s+n[úu]mero\b', address, re.IGNORECASE):
+    if _RE_NO_NUMBER.search(address):
         return None
     
     return None
@@ -252,7 +345,7 @@ def extract_cep(address: str) -> Optional[str]:
         return None
     
     # Padrões de CEP: "12345-678" ou "12345678"
-    match = re.search(r'\b(\d{5}-?\d{3})\b', address)
+    match = _RE_CEP.search(address)
     if match:
         cep = match.group(1).replace('-', '')
         return cep
@@ -260,16 +353,23 @@ def extract_cep(address: str) -> Optional[str]:
     return None
 
 
-def calculate_similarity(str1: str, str2: str) -> float:
+def calculate_similarity(str1: str, str2: str, threshold: float = 0.0) -> float:
     """
-    Calcula similaridade entre duas strings usando SequenceMatcher.
+    Calcula similaridade entre duas strings (ratio de Indel do rapidfuzz, em C).
     
-    Retorna valor entre 0.0 e 1.0.
+    Retorna valor entre 0.0 e 1.0. Com `threshold`, pares que não alcançam o limiar retornam 0.0:
+    diferença de comprimento grande descarta sem comparar e o rapidfuzz para cedo nos demais.
     """
     if not str1 or not str2:
         return 0.0
     
-    return SequenceMatcher(None, str1.lower().strip(), str2.lower().strip()).ratio()
+    str1, str2 = str1.lower().strip(), str2.lower().strip()
+    if threshold:
+        len1, len2 = len(str1), len(str2)
+        # ratio <= 2*min(len)/(len1+len2)
+        if 2 * min(len1, len2) < threshold * (len1 + len2):
+            return 0.0
+    return _fuzz_ratio(str1, str2, score_cutoff=round(threshold * 100, 6)) / 100.0
 
 
 def has_historical_data(record: Dict[str, Any], date_col: Optional[str] = None, 
@@ -355,6 +455,43 @@ def detect_column_names(df: pd.DataFrame) -> Dict[str, Optional[str]]:
     return columns
 
 
+def _history_flags(records: List[Dict[str, Any]], date_col: Optional[str],
+                    persona_col: Optional[str], phrase_col: Optional[str]) -> np.ndarray:
+    """
+    Flag de histórico (Data/Persona/Frase) por registro, como array booleano.
+    
+    Mesma regra de `has_historical_data` (valor "verdadeiro" em alguma das colunas), mas coluna
+    a coluna: astype(bool) avalia a veracidade de cada célula em C e as colunas são combinadas com OR.
+    """
+    mask = np.zeros(len(records), dtype=bool)
+    for col in (date_col, persona_col, phrase_col):
+        if col:
+            values = np.empty(len(records), dtype=object)
+            values[:] = [rec.get(col) for rec in records]
+            mask |= values.astype(bool)
+    return mask
+
+
+def _duplicate_groups(keys: pd.Series, with_history: np.ndarray):
+    """
+    Percorre os grupos de chaves repetidas, na ordem de primeira aparição.
+    
+    Chaves None/vazias não formam grupo. Para cada grupo gera
+    (índices do grupo, índice mantido, justificativa): mantém o primeiro com histórico
+    ou, se nenhum tiver, o primeiro na ordem original.
+    """
+    duplicated = keys[keys.notna() & keys.ne("") & keys.duplicated(keep=False)]
+    positions = duplicated.index.to_numpy()
+    for indices in duplicated.groupby(duplicated, sort=False).indices.values():
+        indices = positions[indices]
+        group_history = with_history[indices]
+        if group_history.any():
+            # Prioridade 1: histórico de contato
+            yield indices, int(indices[group_history.argmax()]), 'mantido por prioridade de histórico (Data/Persona/Frase)'
+        else:
+            yield indices, int(indices[0]), 'mantido por ordem original'
+
+
 def deduplicate_by_instagram(records: List[Dict[str, Any]], 
                              instagram_col: str,
                              date_col: Optional[str],
@@ -367,69 +504,29 @@ def deduplicate_by_instagram(records: List[Dict[str, Any]],
     
     Mantém o registro com histórico (Data/Persona/Frase) ou o primeiro na ordem original.
     
-    Retorna: (registros mantidos, auditoria de deduplicação)
+    Retorna: (registros mantidos, auditoria de deduplicação). A auditoria guarda (posição, registro);
+    o texto das linhas só é montado em `dedup_audit_dataframe`.
     """
-    instagram_map = {}  # normalized_instagram -> lista de índices
-    kept_indices = set(range(len(records)))  # Inicia com todos
+    # Instagram normalizado, uma posição por registro (registros sem Instagram não são
+    # deduplicados por este critério)
+    normalized = pd.Series([normalize_instagram(rec.get(instagram_col, "")) for rec in records], dtype=object)
+    with_history = _history_flags(records, date_col, persona_col, phrase_col)
+    kept = np.ones(len(records), dtype=bool)
     audit = []
     
-    # Agrupa por Instagram normalizado (inclui registros sem Instagram também)
-    for idx, record in enumerate(records):
-        instagram = record.get(instagram_col, "")
-        normalized = normalize_instagram(instagram)
+    for indices, kept_idx, justificativa in _duplicate_groups(normalized, with_history):
+        kept[indices] = False
+        kept[kept_idx] = True
         
-        if normalized:
-            if normalized not in instagram_map:
-                instagram_map[normalized] = []
-            instagram_map[normalized].append(idx)
-        # Registros sem Instagram não são deduplicados por este critério
-    
-    # Processa cada grupo de Instagrams idênticos
-    for normalized_inst, indices in instagram_map.items():
-        if len(indices) <= 1:
-            # Sem duplicatas, mantém
-            kept_indices.add(indices[0])
-            continue
-        
-        # Tem duplicatas - decide qual manter
-        candidates = [(idx, records[idx]) for idx in indices]
-        
-        # Prioridade 1: histórico de contato
-        with_history = [(idx, rec) for idx, rec in candidates 
-                       if has_historical_data(rec, date_col, persona_col, phrase_col)]
-        
-        if with_history:
-            # Mantém o primeiro com histórico
-            kept_idx = with_history[0][0]
-            # Remove os outros do conjunto de mantidos
-            for idx in indices:
-                if idx != kept_idx:
-                    kept_indices.discard(idx)
-            
-            kept_record = records[kept_idx]
-            audit.append({
-                'criterio': 'Instagram idêntico',
-                'linha_mantida': f"#{kept_idx + 1} - {kept_record.get(restaurant_col, '')} | {kept_record.get(instagram_col, '')} | {kept_record.get(address_col, '') if address_col else ''}",
-                'linhas_removidas': [f"#{idx + 1} - {records[idx].get(restaurant_col, '')} | {records[idx].get(instagram_col, '')} | {records[idx].get(address_col, '') if address_col else ''}" for idx in indices if idx != kept_idx],
-                'justificativa': 'mantido por prioridade de histórico (Data/Persona/Frase)'
-            })
-        else:
-            # Sem histórico, mantém o primeiro na ordem original
-            kept_idx = indices[0]
-            # Remove os outros do conjunto de mantidos
-            for idx in indices[1:]:
-                kept_indices.discard(idx)
-            
-            kept_record = records[kept_idx]
-            audit.append({
-                'criterio': 'Instagram idêntico',
-                'linha_mantida': f"#{kept_idx + 1} - {kept_record.get(restaurant_col, '')} | {kept_record.get(instagram_col, '')} | {kept_record.get(address_col, '') if address_col else ''}",
-                'linhas_removidas': [f"#{idx + 1} - {records[idx].get(restaurant_col, '')} | {records[idx].get(instagram_col, '')} | {records[idx].get(address_col, '') if address_col else ''}" for idx in indices[1:]],
-                'justificativa': 'mantido por ordem original'
-            })
+        audit.append({
+            'criterio': 'Instagram idêntico',
+            'linha_mantida': (kept_idx, records[kept_idx]),
+            'linhas_removidas': [(idx, records[idx]) for idx in indices.tolist() if idx != kept_idx],
+            'justificativa': justificativa
+        })
     
     # Retorna apenas os registros mantidos (preserva ordem original)
-    kept_records = [records[i] for i in range(len(records)) if i in kept_indices]
+    kept_records = [records[i] for i in np.flatnonzero(kept).tolist()]
     
     return kept_records, audit
 
@@ -449,155 +546,330 @@ def deduplicate_by_address(records: List[Dict[str, Any]],
     - O logradouro_base for idêntico após normalização
     - CEP idêntico (quando disponível) reforça, mas não é obrigatório
     
-    Retorna: (registros mantidos, auditoria de deduplicação)
+    Retorna: (registros mantidos, auditoria de deduplicação) no mesmo formato de
+    `deduplicate_by_instagram`.
     """
-    address_map = {}  # (logradouro_base, numero, cep) -> lista de índices
-    kept_indices = set(range(len(records)))  # Inicia com todos os índices
-    audit = []
-    
-    # Agrupa por endereço estrito (apenas registros com número)
-    for idx, record in enumerate(records):
-        address = record.get(address_col, "")
+    def strict_key(address: Any) -> Optional[Tuple[str, str, str]]:
+        # Apenas registros com número e logradouro formam chave
         if not address or not isinstance(address, str):
-            continue
-        
+            return None
         number = extract_address_number(address)
         if not number:
-            continue
-        
+            return None
         logradouro_base = normalize_address_street(address)
         if not logradouro_base:
-            continue
+            return None
+        # CEP reforça, mas não é obrigatório
+        return (logradouro_base, number, extract_cep(address) or "")
+    
+    # (logradouro_base, numero, cep) por registro
+    keys = pd.Series([strict_key(rec.get(address_col, "")) for rec in records], dtype=object)
+    with_history = _history_flags(records, date_col, persona_col, phrase_col)
+    kept = np.ones(len(records), dtype=bool)
+    audit = []
+    
+    for indices, kept_idx, justificativa in _duplicate_groups(keys, with_history):
+        kept[indices] = False
+        kept[kept_idx] = True
         
-        # Extrai CEP se disponível (reforça, mas não é obrigatório)
-        cep = extract_cep(address) or ""
+        cep = keys.iat[kept_idx][2]
+        audit.append({
+            'criterio': f'Endereço Estrito (tipo+base+número)' + (f' + CEP {cep}' if cep else ''),
+            'linha_mantida': (kept_idx, records[kept_idx]),
+            'linhas_removidas': [(idx, records[idx]) for idx in indices.tolist() if idx != kept_idx],
+            'justificativa': justificativa
+        })
+    
+    # Retorna apenas os registros mantidos
+    kept_records = [records[i] for i in np.flatnonzero(kept).tolist()]
+    
+    return kept_records, audit
+
+
+DEDUP_AUDIT_COLUMNS = ['Critério de Deduplicação', 'Linha Mantida', 'Linhas Removidas', 'Justificativa']
+
+
+def dedup_audit_dataframe(audit: List[Dict[str, Any]],
+                          restaurant_col: str,
+                          instagram_col: str,
+                          address_col: Optional[str]) -> pd.DataFrame:
+    """
+    Monta a aba de auditoria de deduplicação a partir das entradas estruturadas
+    (posição, registro), formatando cada linha como "#N - restaurante | instagram | endereço".
+    """
+    def line(entry: Tuple[int, Dict[str, Any]]) -> str:
+        pos, record = entry
+        return f"#{pos + 1} - {record.get(restaurant_col, '')} | {record.get(instagram_col, '')} | {record.get(address_col, '') if address_col else ''}"
+    
+    rows = [
+        [item['criterio'], line(item['linha_mantida']), [line(r) for r in item['linhas_removidas']], item['justificativa']]
+        for item in audit
+    ]
+    return pd.DataFrame(rows, columns=DEDUP_AUDIT_COLUMNS)
+
+
+# Menor limiar de similaridade usado no agrupamento (critério 4: nome E Instagram >= 85%)
+MIN_CLUSTER_SIMILARITY = 0.85
+_MIN_CLUSTER_SCORE = round(MIN_CLUSTER_SIMILARITY * 100, 6)  # 0.85 * 100 dá 85.00000000000001
+
+
+def _min_similarity(first: str, others: List[str], threshold: float = MIN_CLUSTER_SIMILARITY) -> float:
+    """
+    Menor `calculate_similarity(first, o, threshold)` entre os `others`, em uma única chamada
+    ao rapidfuzz (matriz 1 x N) em vez de um par por vez.
+    """
+    if not first or not all(others):
+        return 0.0  # calculate_similarity dá 0.0 para string vazia
+    first = first.lower().strip()
+    others = [o.lower().strip() for o in others]
+    score_cutoff = round(threshold * 100, 6)
+    if _cdist is not None:
+        return float(_cdist([first], others, scorer=_fuzz_ratio, score_cutoff=score_cutoff).min()) / 100.0
+    return min(_fuzz_ratio(first, o, score_cutoff=score_cutoff) for o in others) / 100.0
+
+
+def _similar_length_range(length: int, threshold: float = MIN_CLUSTER_SIMILARITY) -> range:
+    """
+    Faixa de comprimentos que ainda pode atingir `threshold` em `calculate_similarity`.
+    
+    ratio() = 2*M / (len_a + len_b) com M <= min(len_a, len_b), então strings com
+    comprimentos muito diferentes nunca alcançam o limiar e podem ser descartadas sem comparar.
+    """
+    low = math.floor(length * threshold / (2 - threshold))
+    high = math.ceil(length * (2 - threshold) / threshold)
+    return range(max(low, 1), high + 1)
+
+
+# A partir deste tamanho a comparação de pares é dividida entre processos
+PARALLEL_CLUSTER_MIN_RECORDS = 5000
+CLUSTER_MAX_WORKERS = 8
+
+
+def _available_cpus() -> int:
+    """CPUs que este processo pode usar (respeita afinidade/cpuset, ao contrário de os.cpu_count())."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class _UnionFind:
+    """Union-find com compressão de caminho (halving) e união por tamanho."""
+    
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+        self.size = [1] * n
+    
+    def find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+    
+    def union(self, a: int, b: int) -> bool:
+        """Une os conjuntos de a e b; retorna False se já estavam juntos."""
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return False
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return True
+
+
+def _cluster_edges(fields: Tuple[List[Any], ...], start: int, stop: int) -> List[Tuple[int, int]]:
+    """
+    Compara cada registro i em [start, stop) com os candidatos j < i e retorna as arestas (i, j)
+    que uniram conjuntos. Pares já ligados por arestas anteriores deste trecho não são comparados.
+    
+    Fica no nível do módulo para poder rodar em um processo separado (ver `identify_clusters`).
+    """
+    names, instagrams, addresses, numbers, logradouros = fields
+    
+    # Índices invertidos, preenchidos à medida que os registros são processados (só contêm j < i)
+    by_logradouro = defaultdict(list)  # logradouro normalizado -> índices
+    names_by_len = defaultdict(list)  # comprimento do nome -> índices
+    instagrams_by_len = defaultdict(list)  # comprimento do Instagram -> índices
+    
+    def index(i: int) -> None:
+        if addresses[i] and logradouros[i]:
+            by_logradouro[logradouros[i]].append(i)
+        if names[i]:
+            names_by_len[len(names[i])].append(i)
+        if instagrams[i]:
+            instagrams_by_len[len(instagrams[i])].append(i)
+    
+    def same_cluster(i: int, j: int) -> bool:
+        # 1. Endereço estrito idêntico
+        if addresses[i] and addresses[j]:
+            number_i, number_j = numbers[i], numbers[j]
+            logradouro_i, logradouro_j = logradouros[i], logradouros[j]
+            if number_i and number_j and number_i == number_j and logradouro_i == logradouro_j:
+                return True
+            if (not number_i or not number_j) and logradouro_i == logradouro_j and logradouro_i:
+                # Mesmo logradouro sem número (dark kitchen ou múltiplas marcas)
+                return True
         
-        key = (logradouro_base, number, cep)
-        if key not in address_map:
-            address_map[key] = []
-        address_map[key].append(idx)
-    
-    # Processa cada grupo de endereços idênticos
-    for (logradouro, numero, cep), indices in address_map.items():
-        if len(indices) <= 1:
-            continue
+        # Scores em 0-100; com score_cutoff o rapidfuzz desiste cedo (e retorna 0) quando o par
+        # não alcança 85%, que é o menor limiar que importa abaixo
+        # 2. Similaridade de nome >= 90%
+        sim_name = 0.0
+        if names[i] and names[j]:
+            # Colunas internadas (ver RestaurantFrame): iguais são o mesmo objeto, e o == resolve
+            # pela identidade sem chamar o rapidfuzz
+            if names[i] == names[j]:
+                return True
+            sim_name = _fuzz_ratio(names[i], names[j], score_cutoff=_MIN_CLUSTER_SCORE)
+            if sim_name >= 90:
+                return True
         
-        # Tem duplicatas - decide qual manter
-        candidates = [(idx, records[idx]) for idx in indices]
+        # 3. Similaridade de Instagram >= 90%
+        sim_inst = 0.0
+        if instagrams[i] and instagrams[j]:
+            if instagrams[i] == instagrams[j]:
+                return True
+            sim_inst = _fuzz_ratio(instagrams[i], instagrams[j], score_cutoff=_MIN_CLUSTER_SCORE)
+            if sim_inst >= 90:
+                return True
         
-        # Prioridade 1: histórico de contato
-        with_history = [(idx, rec) for idx, rec in candidates 
-                       if has_historical_data(rec, date_col, persona_col, phrase_col)]
+        # 4. Nome >= 85% E Instagram >= 85% simultaneamente
+        return sim_name >= _MIN_CLUSTER_SCORE and sim_inst >= _MIN_CLUSTER_SCORE
+    
+    for j in range(start):
+        index(j)
+    
+    components = _UnionFind(stop)
+    edges = []
+    for i in range(start, stop):
+        candidates = set()
+        if addresses[i] and logradouros[i]:
+            candidates.update(by_logradouro.get(logradouros[i], ()))
+        if names[i]:
+            for length in _similar_length_range(len(names[i])):
+                candidates.update(names_by_len.get(length, ()))
+        if instagrams[i]:
+            for length in _similar_length_range(len(instagrams[i])):
+                candidates.update(instagrams_by_len.get(length, ()))
         
-        if with_history:
-            kept_idx = with_history[0][0]
-            # Remove os outros do conjunto de mantidos
-            for idx in indices:
-                if idx != kept_idx:
-                    kept_indices.discard(idx)
-            
-            kept_record = records[kept_idx]
-            audit.append({
-                'criterio': f'Endereço Estrito (tipo+base+número)' + (f' + CEP {cep}' if cep else ''),
-                'linha_mantida': f"#{kept_idx + 1} - {kept_record.get(restaurant_col, '')} | {kept_record.get(instagram_col, '')} | {kept_record.get(address_col, '')}",
-                'linhas_removidas': [f"#{idx + 1} - {records[idx].get(restaurant_col, '')} | {records[idx].get(instagram_col, '')} | {records[idx].get(address_col, '')}" for idx in indices if idx != kept_idx],
-                'justificativa': 'mantido por prioridade de histórico (Data/Persona/Frase)'
-            })
-        else:
-            kept_idx = indices[0]
-            # Remove os outros do conjunto de mantidos
-            for idx in indices[1:]:
-                kept_indices.discard(idx)
-            
-            kept_record = records[kept_idx]
-            audit.append({
-                'criterio': f'Endereço Estrito (tipo+base+número)' + (f' + CEP {cep}' if cep else ''),
-                'linha_mantida': f"#{kept_idx + 1} - {kept_record.get(restaurant_col, '')} | {kept_record.get(instagram_col, '')} | {kept_record.get(address_col, '')}",
-                'linhas_removidas': [f"#{idx + 1} - {records[idx].get(restaurant_col, '')} | {records[idx].get(instagram_col, '')} | {records[idx].get(address_col, '')}" for idx in indices[1:]],
-                'justificativa': 'mantido por ordem original'
-            })
-    
-    # Retorna apenas os registros mantidos
-    kept_records = [records[i] for i in sorted(kept_indices)]
+        for j in candidates:
+            # Já estão no mesmo conjunto: não precisa comparar
+            if components.find(i) != components.find(j) and same_cluster(i, j):
+                components.union(i, j)
+                edges.append((i, j))
+        
+        index(i)
     
-    return kept_records, audit
+    return edges
+
+
+def _parallel_cluster_edges(fields: Tuple[List[Any], ...], workers: int) -> List[Tuple[int, int]]:
+    """
+    Divide os registros em faixas com número parecido de pares (i compara com todos os j < i,
+    então as faixas finais são mais curtas) e roda `_cluster_edges` de cada faixa em um processo.
+    """
+    n = len(fields[0])
+    bounds = [round(n * math.sqrt(k / workers)) for k in range(workers + 1)]
+    # spawn: o backend tem threads (uvicorn/automação) e fork com threads não é seguro
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(_cluster_edges, fields, a, b) for a, b in zip(bounds, bounds[1:]) if a < b]
+        return [edge for future in futures for edge in future.result()]
+
+
+def _cell_text(value: Any) -> str:
+    """Valor de célula como texto; None/NaN (célula vazia do read_excel) vira "" em vez de "nan"."""
+    if value is None:
+        return ""
+    try:
+        if pd.isna(value):
+            return ""
+    except (TypeError, ValueError):
+        pass
+    return str(value)
+
+
+@dataclass
+class RestaurantFrame:
+    """
+    Registros já deduplicados + colunas normalizadas uma única vez (listas paralelas, indexadas
+    pelo registro). Montado uma vez no pipeline e reaproveitado pelas etapas seguintes, em vez de
+    cada etapa reler os dicts e normalizar de novo.
+    """
+    records: List[Dict[str, Any]]
+    names: List[str]  # nome em minúsculas, sem espaços nas pontas
+    instagrams: List[str]  # Instagram normalizado
+    addresses: List[str]  # endereço original sem espaços nas pontas
+    numbers: List[Optional[str]]  # número do endereço
+    logradouros: List[str]  # logradouro normalizado
+    
+    @classmethod
+    def from_records(cls, records: List[Dict[str, Any]], restaurant_col: str,
+                     instagram_col: str, address_col: Optional[str]) -> "RestaurantFrame":
+        # Nomes já em minúsculas: o par é comparado direto no rapidfuzz, sem repetir lower()/strip()
+        # As colunas comparadas por igualdade são internadas: valores repetidos (redes, mesmo
+        # logradouro) viram um único objeto, e o == entre eles é uma comparação de ponteiros
+        # Células vazias (NaN) viram "": senão todas as linhas sem endereço teriam o logradouro
+        # "nan" e cairiam no mesmo cluster
+        names = [sys.intern(_cell_text(rec.get(restaurant_col, "")).strip().lower().strip()) for rec in records]
+        instagrams = [sys.intern(normalize_instagram(_cell_text(rec.get(instagram_col, "")))) for rec in records]
+        addresses = [_cell_text(rec.get(address_col or "", "")).strip() for rec in records]
+        numbers = [extract_address_number(addr) if addr else None for addr in addresses]
+        logradouros = [sys.intern(normalize_address_street(addr)) if addr else "" for addr in addresses]
+        return cls(records, names, instagrams, addresses, numbers, logradouros)
+    
+    @property
+    def fields(self) -> Tuple[List[Any], ...]:
+        """Colunas usadas na comparação de pares (ver `_cluster_edges`)."""
+        return (self.names, self.instagrams, self.addresses, self.numbers, self.logradouros)
 
 
 def identify_clusters(records: List[Dict[str, Any]],
                      restaurant_col: str,
                      instagram_col: str,
-                     address_col: str) -> Dict[int, List[int]]:
+                     address_col: str,
+                     frame: Optional[RestaurantFrame] = None) -> Dict[int, List[int]]:
     """
     Identifica clusters de registros que pertencem ao mesmo grupo/rede/dono.
     
+    Pares que atendem a algum critério são unidos em uma union-find, então o agrupamento é
+    transitivo (A~B e B~C colocam A, B e C no mesmo cluster). Em vez de comparar com todos os
+    anteriores, os candidatos vêm de índices invertidos (logradouro normalizado e comprimento de
+    nome/Instagram compatível com o limiar), que nunca descartam um par capaz de casar.
+    Arquivos grandes têm a comparação de pares dividida entre processos; o resultado é o mesmo.
+    
+    Se `frame` for passado (mesmos registros), reaproveita as colunas já normalizadas.
+    
     Retorna um dicionário: cluster_id -> lista de índices dos registros no cluster.
     """
-    clusters = {}  # cluster_id -> set de índices
-    record_to_cluster = {}  # índice -> cluster_id
-    next_cluster_id = 1
-    
+    if frame is None:
+        frame = RestaurantFrame.from_records(records, restaurant_col, instagram_col, address_col)
+    fields = frame.fields
+    
+    edges = None
+    # Com menos de 2 CPUs disponíveis o custo de subir os processos só atrasa: fica no serial
+    workers = min(_available_cpus(), CLUSTER_MAX_WORKERS)
+    if len(records) >= PARALLEL_CLUSTER_MIN_RECORDS and workers >= 2:
+        try:
+            edges = _parallel_cluster_edges(fields, workers)
+        except (OSError, BrokenProcessPool) as e:
+            logger.warning(f"Agrupamento paralelo indisponível ({e}); seguindo em um processo")
+    if edges is None:
+        edges = _cluster_edges(fields, 0, len(records))
+    
+    components = _UnionFind(len(records))
+    for i, j in edges:
+        components.union(i, j)
+    
+    # Agrupa por representante; ids seguem a ordem do primeiro registro de cada grupo
+    clusters = {}  # cluster_id -> lista de índices
+    root_to_cluster = {}
     for i in range(len(records)):
-        record_i = records[i]
-        name_i = str(record_i.get(restaurant_col, "")).strip()
-        instagram_i = normalize_instagram(str(record_i.get(instagram_col, "")))
-        address_i = str(record_i.get(address_col, "")).strip()
-        
-        # Verifica se já pertence a algum cluster
-        cluster_id = None
-        for j in range(i):
-            if j in record_to_cluster:
-                record_j = records[j]
-                name_j = str(record_j.get(restaurant_col, "")).strip()
-                instagram_j = normalize_instagram(str(record_j.get(instagram_col, "")))
-                address_j = str(record_j.get(address_col, "")).strip()
-                
-                # Verifica critérios de agrupamento
-                same_cluster = False
-                
-                # 1. Endereço estrito idêntico
-                if address_i and address_j:
-                    number_i = extract_address_number(address_i)
-                    number_j = extract_address_number(address_j)
-                    logradouro_i = normalize_address_street(address_i)
-                    logradouro_j = normalize_address_street(address_j)
-                    
-                    if number_i and number_j and number_i == number_j and logradouro_i == logradouro_j:
-                        same_cluster = True
-                    elif (not number_i or not number_j) and logradouro_i == logradouro_j and logradouro_i:
-                        # Mesmo logradouro sem número (dark kitchen ou múltiplas marcas)
-                        same_cluster = True
-                
-                # 2. Similaridade de nome >= 90%
-                if not same_cluster and name_i and name_j:
-                    sim_name = calculate_similarity(name_i, name_j)
-                    if sim_name >= 0.90:
-                        same_cluster = True
-                
-                # 3. Similaridade de Instagram >= 90%
-                if not same_cluster and instagram_i and instagram_j:
-                    sim_inst = calculate_similarity(instagram_i, instagram_j)
-                    if sim_inst >= 0.90:
-                        same_cluster = True
-                
-                # 4. Nome >= 85% E Instagram >= 85% simultaneamente
-                if not same_cluster and name_i and name_j and instagram_i and instagram_j:
-                    sim_name = calculate_similarity(name_i, name_j)
-                    sim_inst = calculate_similarity(instagram_i, instagram_j)
-                    if sim_name >= 0.85 and sim_inst >= 0.85:
-                        same_cluster = True
-                
-                if same_cluster:
-                    cluster_id = record_to_cluster[j]
-                    break
-        
-        # Se não encontrou cluster, cria novo
+        root = components.find(i)
+        cluster_id = root_to_cluster.get(root)
         if cluster_id is None:
-            cluster_id = next_cluster_id
-            next_cluster_id += 1
+            cluster_id = root_to_cluster[root] = len(root_to_cluster) + 1
             clusters[cluster_id] = []
-        
         clusters[cluster_id].append(i)
-        record_to_cluster[i] = cluster_id
     
     # Remove clusters com apenas 1 registro (não são clusters de verdade)
     return {cid: indices for cid, indices in clusters.items() if len(indices) > 1}
@@ -611,7 +883,8 @@ def distribute_into_blocks(records: List[Dict[str, Any]],
                            max_block_size: int = 10,
                            min_block_size: int = 5,
                            existing_blocos: Optional[Dict[int, int]] = None,
-                           start_block_num: int = 1) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+                           start_block_num: int = 1,
+                           frame: Optional[RestaurantFrame] = None) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], int]:
     """
     Distribui registros em blocos de min_block_size a max_block_size, garantindo que registros
     do mesmo cluster não fiquem no mesmo bloco.
@@ -625,109 +898,140 @@ def distribute_into_blocks(records: List[Dict[str, Any]],
     Cada bloco deve ter entre min_block_size e max_block_size registros (quando possível).
     O último bloco pode ter menos que min_block_size se não houver registros suficientes.
     
-    Retorna: (registros com campo 'Bloco' preenchido, auditoria de clusters)
+    O campo 'Bloco' é gravado nos próprios dicts recebidos (sem copiar cada registro).
+    A auditoria usa as colunas normalizadas de `frame` (mesmos registros), se for passado.
+    
+    Retorna: (registros com campo 'Bloco' preenchido, auditoria de clusters, maior bloco atribuído)
     """
-    # Cria cópia dos registros
-    records_with_blocks = [dict(rec) for rec in records]
+    records_with_blocks = records
     
     # Garante que todos os registros receberão um bloco
     if not records_with_blocks:
-        return records_with_blocks, []
+        return records_with_blocks, [], 0
     
-    # Mapa: índice do registro -> cluster_id (None se não está em cluster)
-    record_cluster = {}
+    # Índice do registro -> cluster_id (None se não está em cluster); índices são densos em
+    # [0, N), então uma lista indexada substitui o dict
+    record_cluster = [None] * len(records_with_blocks)
     for cluster_id, indices in clusters.items():
         for idx in indices:
             record_cluster[idx] = cluster_id
     
-    # Agrupa registros por cluster para distribuição cíclica
-    cluster_records = defaultdict(list)
-    standalone_records = []
-    
-    for idx in range(len(records_with_blocks)):
-        cluster_id = record_cluster.get(idx)
-        if cluster_id:
-            cluster_records[cluster_id].append(idx)
-        else:
-            standalone_records.append(idx)
-    
     # Distribui registros em blocos
-    blocks = []  # Lista de listas de índices
+    blocks = []  # Lista de arrays de índices (inteiros contíguos, sem um objeto int por posição)
     block_clusters = []  # Lista de sets de cluster_ids por bloco
     
     # Preserva blocos existentes se for manutenção incremental
+    preassigned = [False] * len(records_with_blocks)  # máscara por índice de registro
+    # Blocos existentes abaixo de start_block_num (o caso normal: os novos começam depois do
+    # maior existente) ficam como estão, fora da distribuição; como os novos blocos têm números
+    # maiores, esses registros nunca dividem bloco com os novos
+    kept_existing = []  # índices de registros com bloco existente < start_block_num
+    max_kept = 0
     if existing_blocos:
         for idx, bloco_num in existing_blocos.items():
             if idx < len(records_with_blocks):
                 # Ajusta índice do bloco para começar após os existentes
                 adjusted_bloco = bloco_num - start_block_num + 1
+                if adjusted_bloco < 1:
+                    records_with_blocks[idx]['Bloco'] = bloco_num
+                    kept_existing.append(idx)
+                    max_kept = max(max_kept, bloco_num)
+                    preassigned[idx] = True
+                    continue
                 while len(blocks) < adjusted_bloco:
-                    blocks.append([])
+                    blocks.append(array('i'))
                     block_clusters.append(set())
                 blocks[adjusted_bloco - 1].append(idx)
-                cluster_id = record_cluster.get(idx)
+                cluster_id = record_cluster[idx]
                 if cluster_id:
                     block_clusters[adjusted_bloco - 1].add(cluster_id)
-                # Remove dos standalone se estava lá
-                if idx in standalone_records:
-                    standalone_records.remove(idx)
-                # Remove dos clusters se estava lá
-                for cid, cindices in cluster_records.items():
-                    if idx in cindices:
-                        cindices.remove(idx)
+                preassigned[idx] = True
+    
+    # Agrupa registros (ainda sem bloco) por cluster para distribuição cíclica
+    cluster_records = defaultdict(list)
+    standalone_records = []
+    
+    for idx in range(len(records_with_blocks)):
+        cluster_id = record_cluster[idx]
+        if cluster_id:
+            # A chave é criada mesmo para registro pré-atribuído, preservando a ordem dos clusters
+            members = cluster_records[cluster_id]
+            if not preassigned[idx]:
+                members.append(idx)
+        elif not preassigned[idx]:
+            standalone_records.append(idx)
+    
+    # Blocos só crescem nesta fase, então um bloco que enche nunca volta a ter vaga: heaps de
+    # índices com remoção preguiçosa devolvem sempre o bloco de menor índice com vaga, que é o
+    # mesmo que a varredura linear escolheria
+    open_blocks = [b_idx for b_idx, block in enumerate(blocks) if len(block) < max_block_size]  # já ordenado
+    
+    def new_block(idx: int, cluster_id: Optional[int] = None) -> None:
+        blocks.append(array('i', (idx,)))
+        block_clusters.append({cluster_id} if cluster_id else set())
+        if max_block_size > 1:
+            heapq.heappush(open_blocks, len(blocks) - 1)
     
     # Primeiro, distribui registros de clusters de forma cíclica
     # Distribuição cíclica real: 1º do cluster → próximo bloco disponível, 2º → próximo, etc.
     # SEM LIMITE no número total de blocos - cria quantos forem necessários
     for cluster_id, cluster_indices in cluster_records.items():
-        if not cluster_indices:  # Pula se vazio (já foi processado)
-            continue
-        
-        for pos, idx in enumerate(cluster_indices):
-            # Encontra próximo bloco disponível que não contenha este cluster
-            assigned = False
-            # Tenta blocos existentes primeiro
-            for b_idx in range(len(blocks)):
-                if len(blocks[b_idx]) < max_block_size and cluster_id not in block_clusters[b_idx]:
-                    blocks[b_idx].append(idx)
-                    block_clusters[b_idx].add(cluster_id)
-                    assigned = True
+        for idx in cluster_indices:
+            # Menor bloco com vaga que não contenha este cluster; os que já contêm são
+            # separados e devolvidos ao heap depois (no máximo um por membro do cluster)
+            skipped = []
+            target = None
+            while open_blocks:
+                b_idx = open_blocks[0]
+                if len(blocks[b_idx]) >= max_block_size:
+                    heapq.heappop(open_blocks)  # cheio: sai de vez
+                elif cluster_id in block_clusters[b_idx]:
+                    skipped.append(heapq.heappop(open_blocks))
+                else:
+                    target = b_idx
                     break
+            for b_idx in skipped:
+                heapq.heappush(open_blocks, b_idx)
             
-            if not assigned:
+            if target is not None:
+                blocks[target].append(idx)
+                block_clusters[target].add(cluster_id)
+            else:
                 # Cria novo bloco (SEM LIMITE - cria quantos forem necessários)
-                blocks.append([idx])
-                block_clusters.append(set([cluster_id]))
+                new_block(idx, cluster_id)
     
     # Depois, distribui registros standalone (sem cluster)
     # Prioriza preencher blocos existentes até min_block_size antes de criar novos
+    hungry_blocks = [b_idx for b_idx, block in enumerate(blocks)
+                     if len(block) < min_block_size and len(block) < max_block_size]
     for idx in standalone_records:
-        assigned = False
         # Primeiro tenta adicionar a blocos que ainda não atingiram min_block_size
-        for block_idx, block_cluster_set in enumerate(block_clusters):
-            if len(blocks[block_idx]) < min_block_size and len(blocks[block_idx]) < max_block_size:
-                blocks[block_idx].append(idx)
-                assigned = True
-                break
-        
+        while hungry_blocks and len(blocks[hungry_blocks[0]]) >= min(min_block_size, max_block_size):
+            heapq.heappop(hungry_blocks)
         # Se não encontrou bloco para preencher até min_block_size, tenta qualquer bloco disponível
-        if not assigned:
-            for block_idx, block_cluster_set in enumerate(block_clusters):
-                if len(blocks[block_idx]) < max_block_size:
-                    blocks[block_idx].append(idx)
-                    assigned = True
-                    break
+        while open_blocks and len(blocks[open_blocks[0]]) >= max_block_size:
+            heapq.heappop(open_blocks)
         
-        # Se não encontrou nenhum bloco disponível, cria novo
-        if not assigned:
-            blocks.append([idx])
-            block_clusters.append(set())
+        if hungry_blocks:
+            blocks[hungry_blocks[0]].append(idx)
+        elif open_blocks:
+            blocks[open_blocks[0]].append(idx)
+        else:
+            # Se não encontrou nenhum bloco disponível, cria novo
+            new_block(idx)
+            if 1 < min(min_block_size, max_block_size):
+                heapq.heappush(hungry_blocks, len(blocks) - 1)
     
     # Balanceamento: garante que blocos tenham pelo menos min_block_size quando possível
     # Move registros de blocos pequenos para blocos maiores (respeitando clusters)
     # Tenta consolidar blocos pequenos até atingir min_block_size
     if len(blocks) > 1:
         # Primeira passada: tenta mover registros de blocos pequenos para blocos maiores
+        # Destinos possíveis: blocos com min_block_size..max_block_size-1 registros. Nesta passada
+        # eles só crescem e os blocos pequenos só encolhem, então nenhum bloco passa a ser destino;
+        # um heap de índices com remoção preguiçosa dos que encheram devolve o mesmo bloco
+        # (o de menor índice) que a varredura completa escolheria
+        targets = [i for i, b in enumerate(blocks) if min_block_size <= len(b) < max_block_size]  # já ordenado
         max_iterations = 20  # Limita iterações para evitar loop infinito
         for iteration in range(max_iterations):
             changed = False
@@ -742,33 +1046,45 @@ def distribute_into_blocks(records: List[Dict[str, Any]],
                 if len(blocks[b_idx]) == 0:
                     continue
                 
-                records_to_move = list(blocks[b_idx])  # Cria cópia para iterar com segurança
-                for idx in records_to_move:
-                    cluster_id = record_cluster.get(idx)
+                # O bloco é reconstruído uma vez no fim com os que ficaram (na mesma ordem), em vez
+                # de um remove() O(k) por registro movido
+                records_to_move = blocks[b_idx]
+                kept = array('i')
+                for pos, idx in enumerate(records_to_move):
+                    cluster_id = record_cluster[idx]
                     
                     # Prioriza blocos que já têm pelo menos min_block_size mas ainda têm espaço
+                    # (o bloco pequeno nunca está no heap, então não é candidato a si mesmo)
                     best_target = None
-                    for target_idx in range(len(blocks)):
-                        if (target_idx != b_idx and 
-                            len(blocks[target_idx]) >= min_block_size and 
-                            len(blocks[target_idx]) < max_block_size):
-                            if cluster_id is None or cluster_id not in block_clusters[target_idx]:
-                                best_target = target_idx
-                                break
+                    skipped = []
+                    while targets:
+                        target_idx = targets[0]
+                        if len(blocks[target_idx]) >= max_block_size:
+                            heapq.heappop(targets)  # cheio: sai de vez
+                        elif cluster_id is not None and cluster_id in block_clusters[target_idx]:
+                            skipped.append(heapq.heappop(targets))
+                        else:
+                            best_target = target_idx
+                            break
+                    for target_idx in skipped:
+                        heapq.heappush(targets, target_idx)
                     
                     if best_target is not None:
                         # Move para bloco maior
                         blocks[best_target].append(idx)
                         if cluster_id:
                             block_clusters[best_target].add(cluster_id)
-                        blocks[b_idx].remove(idx)
-                        if cluster_id:
+                        # Só tira o cluster do bloco se não restou outro registro dele (blocos
+                        # pré-atribuídos podem ter mais de um), mantendo block_clusters exato
+                        if (cluster_id
+                                and all(record_cluster[j] != cluster_id for j in kept)
+                                and all(record_cluster[j] != cluster_id for j in records_to_move[pos + 1:])):
                             block_clusters[b_idx].discard(cluster_id)
                         changed = True
-                        
-                        # Se o bloco pequeno ficou vazio, pode parar de tentar mover deste bloco
-                        if len(blocks[b_idx]) == 0:
-                            break
+                    else:
+                        kept.append(idx)
+                
+                blocks[b_idx] = kept
             
             if not changed:
                 break  # Não conseguiu mais mover nada
@@ -790,51 +1106,48 @@ def distribute_into_blocks(records: List[Dict[str, Any]],
                     if total_size > max_block_size:
                         continue
                     
-                    # Verifica conflitos de cluster
-                    can_consolidate = True
-                    for idx in blocks[b_idx2]:
-                        cluster_id = record_cluster.get(idx)
-                        if cluster_id and cluster_id in block_clusters[b_idx1]:
-                            can_consolidate = False
-                            break
-                    
-                    if can_consolidate:
+                    # Verifica conflitos de cluster (block_clusters acompanha exatamente os registros de cada bloco)
+                    if block_clusters[b_idx1].isdisjoint(block_clusters[b_idx2]):
                         # Move todos os registros de b_idx2 para b_idx1
-                        for idx in list(blocks[b_idx2]):
-                            cluster_id = record_cluster.get(idx)
-                            blocks[b_idx1].append(idx)
-                            if cluster_id:
-                                block_clusters[b_idx1].add(cluster_id)
-                            if cluster_id:
-                                block_clusters[b_idx2].discard(cluster_id)
-                        blocks[b_idx2].clear()
+                        blocks[b_idx1].extend(blocks[b_idx2])
+                        block_clusters[b_idx1] |= block_clusters[b_idx2]
+                        del blocks[b_idx2][:]  # esvazia no lugar; a remoção dos vazios vem no fim
+                        block_clusters[b_idx2].clear()
                         
                         # Se consolidou e atingiu min_block_size, pode parar
                         if len(blocks[b_idx1]) >= min_block_size:
                             break
         
-        # Remove blocos vazios
-        blocks = [b for b in blocks if len(b) > 0]
-        block_clusters = [bc for i, bc in enumerate(block_clusters) if i < len(blocks)]
+        # Remove blocos vazios (mantendo block_clusters alinhado com blocks)
+        non_empty = [b_idx for b_idx, block in enumerate(blocks) if block]
+        blocks = [blocks[b_idx] for b_idx in non_empty]
+        block_clusters = [block_clusters[b_idx] for b_idx in non_empty]
     
     # GARANTE que todos os registros receberam um bloco
     # Se algum registro não foi atribuído (edge case), atribui ao último bloco ou cria novo
-    all_assigned_indices = set()
+    assigned = [False] * len(records_with_blocks)
     for block in blocks:
-        all_assigned_indices.update(block)
+        for idx in block:
+            assigned[idx] = True
+    for idx in kept_existing:
+        assigned[idx] = True
     
     for idx in range(len(records_with_blocks)):
-        if idx not in all_assigned_indices:
+        if not assigned[idx]:
             # Registro não foi atribuído - adiciona ao último bloco ou cria novo
             if blocks and len(blocks[-1]) < max_block_size:
                 blocks[-1].append(idx)
             else:
-                blocks.append([idx])
+                blocks.append(array('i', (idx,)))
                 block_clusters.append(set())
     
     # Atribui números de bloco (ajustando para manutenção incremental)
     # SEM LIMITE no número total de blocos - numera sequencialmente quantos forem criados
+    # O maior bloco sai desta mesma passada, sem os chamadores varrerem os registros de novo
+    max_block = max_kept
     for block_num, block_indices in enumerate(blocks, start=start_block_num):
+        if block_indices:
+            max_block = block_num
         for idx in block_indices:
             records_with_blocks[idx]['Bloco'] = block_num
     
@@ -846,10 +1159,14 @@ def distribute_into_blocks(records: List[Dict[str, Any]],
                 record['Bloco'] = len(blocks) + start_block_num - 1
             else:
                 record['Bloco'] = start_block_num
-                blocks.append([idx])
+                blocks.append(array('i', (idx,)))
                 block_clusters.append(set())
+            max_block = max(max_block, record['Bloco'])
     
     # Cria auditoria de clusters
+    # Instagram, número e logradouro vêm normalizados uma vez por registro (não uma vez por cluster)
+    if clusters and frame is None:
+        frame = RestaurantFrame.from_records(records_with_blocks, restaurant_col, instagram_col, address_col)
     cluster_audit = []
     for cluster_id, indices in clusters.items():
         cluster_records_list = []
@@ -867,32 +1184,32 @@ def distribute_into_blocks(records: List[Dict[str, Any]],
             criteria = []
             
             # Verifica similaridade de nome
-            names = [str(records_with_blocks[idx].get(restaurant_col, '')).strip() for idx in indices]
+            # Nome sem normalizar caixa: "Nome idêntico" diferencia maiúsculas
+            names = [str(r['restaurante']).strip() for r in cluster_records_list]
             if len(set(names)) == 1:
                 criteria.append("Nome idêntico")
             elif len(names) > 1:
-                sims = [calculate_similarity(names[0], n) for n in names[1:]]
-                if all(s >= 0.90 for s in sims):
+                sim = _min_similarity(names[0], names[1:])
+                if sim >= 0.90:
                     criteria.append("Similaridade de nome ≥90%")
-                elif all(s >= 0.85 for s in sims):
+                elif sim >= 0.85:
                     criteria.append("Similaridade de nome ≥85%")
             
             # Verifica similaridade de Instagram
-            instagrams = [normalize_instagram(str(records_with_blocks[idx].get(instagram_col, ''))) for idx in indices]
+            instagrams = [frame.instagrams[idx] for idx in indices]
             if len(set(instagrams)) == 1:
                 criteria.append("Instagram idêntico")
             elif len(instagrams) > 1:
-                sims = [calculate_similarity(instagrams[0], inst) for inst in instagrams[1:]]
-                if all(s >= 0.90 for s in sims):
+                sim = _min_similarity(instagrams[0], instagrams[1:])
+                if sim >= 0.90:
                     criteria.append("Similaridade de Instagram ≥90%")
-                elif all(s >= 0.85 for s in sims):
+                elif sim >= 0.85:
                     criteria.append("Similaridade de Instagram ≥85%")
             
             # Verifica endereço
             if address_col:
-                addresses = [str(records_with_blocks[idx].get(address_col, '')).strip() for idx in indices]
-                numbers = [extract_address_number(addr) for addr in addresses]
-                logradouros = [normalize_address_street(addr) for addr in addresses]
+                numbers = [frame.numbers[idx] for idx in indices]
+                logradouros = [frame.logradouros[idx] for idx in indices]
                 
                 if all(n and n == numbers[0] for n in numbers if n) and all(l == logradouros[0] for l in logradouros if l):
                     criteria.append("Endereço estrito idêntico")
@@ -903,10 +1220,56 @@ def distribute_into_blocks(records: List[Dict[str, Any]],
                 'id_cluster': cluster_id,
                 'restaurantes': cluster_records_list,
                 'criterio_associacao': '; '.join(criteria) if criteria else 'Múltiplos critérios',
-                'blocos_atribuidos': sorted(set([r['bloco'] for r in cluster_records_list if r['bloco']]))
+                'blocos_atribuidos': sorted({r['bloco'] for r in cluster_records_list if r['bloco']})
             })
     
-    return records_with_blocks, cluster_audit
+    return records_with_blocks, cluster_audit, max_block
+
+
+def read_restaurants_sheet(input_path: str) -> pd.DataFrame:
+    """
+    Lê a aba 'Restaurantes' com o leitor em Rust do python-calamine (bem mais rápido que o
+    openpyxl, que interpreta o XML em Python). Sem o pacote, ou em pandas sem o engine, usa o openpyxl.
+    """
+    if _HAS_CALAMINE:
+        try:
+            return pd.read_excel(input_path, sheet_name='Restaurantes', engine='calamine')
+        except (ImportError, ValueError) as e:
+            logger.debug(f"Leitura com calamine indisponível ({e}); usando openpyxl")
+    return pd.read_excel(input_path, sheet_name='Restaurantes')
+
+
+def _write_as_text(worksheet, row: int, col: int, value: Any, *args):
+    return worksheet.write_string(row, col, str(value), *args)
+
+
+def write_excel_sheets(output_path: str, sheets: List[Tuple[str, pd.DataFrame]]) -> None:
+    """
+    Grava os DataFrames em abas de um .xlsx com o xlsxwriter em modo constant_memory: cada linha
+    vai para o disco assim que a próxima começa, em vez de manter todas as células em memória.
+    
+    O modo exige escrita linha a linha; `DataFrame.to_excel` escreve coluna a coluna (e perderia
+    dados nesse modo), então as linhas são gravadas aqui. Nulos viram células vazias, como no to_excel.
+    """
+    workbook = xlsxwriter.Workbook(output_path, {
+        'constant_memory': True,
+        'strings_to_urls': False,  # links do Instagram ficam como texto
+        'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+        'remove_timezone': True,
+    })
+    try:
+        header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center'})
+        for sheet_name, df in sheets:
+            worksheet = workbook.add_worksheet(sheet_name)
+            for container in (list, tuple, dict, set):
+                # Como o to_excel: valores sem tipo próprio no Excel vão como texto
+                worksheet.add_write_handler(container, _write_as_text)
+            worksheet.write_row(0, 0, [str(col) for col in df.columns], header_format)
+            values = df.astype(object).where(df.notna(), None)
+            for row_num, row in enumerate(values.itertuples(index=False, name=None), start=1):
+                worksheet.write_row(row_num, 0, row)
+    finally:
+        workbook.close()
 
 
 def process_restaurants_excel(input_path: str, output_path: Optional[str] = None) -> Dict[str, Any]:
@@ -928,7 +1291,7 @@ def process_restaurants_excel(input_path: str, output_path: Optional[str] = None
     """
     # Lê o arquivo Excel
     try:
-        df = pd.read_excel(input_path, sheet_name='Restaurantes')
+        df = read_restaurants_sheet(input_path)
     except Exception as e:
         raise ValueError(f"Erro ao ler arquivo Excel: {e}")
     
@@ -953,21 +1316,18 @@ def process_restaurants_excel(input_path: str, output_path: Optional[str] = None
     
     # Verifica se já existe coluna "Bloco" para manutenção incremental
     # IMPORTANTE: Mapear blocos ANTES da deduplicação, pois índices mudam
-    original_records = df.to_dict('records')
+    # (a deduplicação devolve listas novas e não altera os dicts, então basta guardar a lista original)
+    original_records = records
     existing_blocos_map = {}  # índice original -> bloco
     if 'Bloco' in df.columns:
-        for orig_idx, orig_record in enumerate(original_records):
-            bloco_val = orig_record.get('Bloco')
-            if bloco_val and pd.notna(bloco_val):
-                try:
-                    existing_blocos_map[orig_idx] = int(bloco_val)
-                except (ValueError, TypeError):
-                    pass
+        # Conversão vetorizada; vazios, 0 e valores não numéricos ficam de fora
+        blocos = pd.to_numeric(df['Bloco'], errors='coerce').to_numpy(dtype=float)
+        valid = np.isfinite(blocos) & (blocos != 0)
+        existing_blocos_map = dict(zip(np.flatnonzero(valid).tolist(), blocos[valid].astype(int).tolist()))
         max_existing_bloco = max(existing_blocos_map.values()) if existing_blocos_map else 0
         logger.info(f"Encontrados {len(existing_blocos_map)} registros com blocos existentes. Último bloco: {max_existing_bloco}")
     else:
         max_existing_bloco = 0
-        existing_blocos_map = {}
     
     # 1. Deduplicação por Instagram
     records, audit_instagram = deduplicate_by_instagram(
@@ -983,54 +1343,50 @@ def process_restaurants_excel(input_path: str, output_path: Optional[str] = None
         )
         logger.info(f"Após deduplicação por Endereço: {len(records)} registros")
     
-    # 3. Identificação de clusters
-    clusters = identify_clusters(records, restaurant_col, instagram_col, address_col or '')
+    # 3. Identificação de clusters (colunas normalizadas uma vez e reaproveitadas)
+    frame = RestaurantFrame.from_records(records, restaurant_col, instagram_col, address_col)
+    clusters = identify_clusters(records, restaurant_col, instagram_col, address_col or '', frame=frame)
     logger.info(f"Identificados {len(clusters)} clusters")
     
     # 4. Mapeia blocos existentes para registros após deduplicação
     # Cria um identificador único para cada registro (restaurante + instagram) para mapear
     existing_blocos_after_dedup = {}
     if existing_blocos_map:
-        # Cria mapa de identificadores únicos
-        orig_identifiers = {}
-        for orig_idx, orig_record in enumerate(original_records):
-            rest_name = str(orig_record.get(restaurant_col, '')).strip().lower()
-            insta = normalize_instagram(str(orig_record.get(instagram_col, '')))
-            identifier = f"{rest_name}|{insta}"
-            orig_identifiers[orig_idx] = identifier
+        # Identificador -> bloco do primeiro registro original com esse identificador e com bloco
+        identifier_to_bloco = {}
+        for orig_idx, bloco in existing_blocos_map.items():  # em ordem de orig_idx
+            orig_record = original_records[orig_idx]
+            # Mesma normalização do frame, para os identificadores baterem
+            rest_name = _cell_text(orig_record.get(restaurant_col, '')).strip().lower().strip()
+            insta = normalize_instagram(_cell_text(orig_record.get(instagram_col, '')))
+            identifier_to_bloco.setdefault(f"{rest_name}|{insta}", bloco)
         
-        # Mapeia para registros após deduplicação
-        for new_idx, record in enumerate(records):
-            rest_name = str(record.get(restaurant_col, '')).strip().lower()
-            insta = normalize_instagram(str(record.get(instagram_col, '')))
-            identifier = f"{rest_name}|{insta}"
-            
-            # Encontra índice original correspondente
-            for orig_idx, orig_id in orig_identifiers.items():
-                if orig_id == identifier and orig_idx in existing_blocos_map:
-                    existing_blocos_after_dedup[new_idx] = existing_blocos_map[orig_idx]
-                    break
+        # Mapeia para registros após deduplicação (nome e Instagram já normalizados no frame)
+        for new_idx, (rest_name, insta) in enumerate(zip(frame.names, frame.instagrams)):
+            bloco = identifier_to_bloco.get(f"{rest_name}|{insta}")
+            if bloco is not None:
+                existing_blocos_after_dedup[new_idx] = bloco
     
     # 4. Distribuição em blocos (SEMPRE atribui blocos a todos os registros)
     # Cada bloco deve ter entre 5 e 10 registros quando possível
-    records_with_blocks, cluster_audit = distribute_into_blocks(
+    records_with_blocks, cluster_audit, total_blocks = distribute_into_blocks(
         records, clusters, restaurant_col, instagram_col, address_col, 
         max_block_size=10,
         min_block_size=5,
         existing_blocos=existing_blocos_after_dedup if existing_blocos_after_dedup else None,
-        start_block_num=max_existing_bloco + 1 if max_existing_bloco > 0 else 1
+        start_block_num=max_existing_bloco + 1 if max_existing_bloco > 0 else 1,
+        frame=frame
     )
     
     # Verifica que todos os registros receberam blocos
     records_without_blocks = [i for i, rec in enumerate(records_with_blocks) if 'Bloco' not in rec or rec.get('Bloco') is None]
     if records_without_blocks:
         logger.warning(f"ATENÇÃO: {len(records_without_blocks)} registros não receberam blocos. Corrigindo...")
-        # Corrige atribuindo ao último bloco ou criando novo
-        max_bloco = max((rec.get('Bloco', 0) or 0 for rec in records_with_blocks), default=0)
+        # Corrige criando um novo bloco depois do último
+        total_blocks += 1
         for idx in records_without_blocks:
-            records_with_blocks[idx]['Bloco'] = max_bloco + 1
+            records_with_blocks[idx]['Bloco'] = total_blocks
     
-    total_blocks = max((rec.get('Bloco', 0) or 0 for rec in records_with_blocks), default=0)
     logger.info(f"Distribuídos {len(records_with_blocks)} registros em {total_blocks} blocos (sem limite no número total de blocos)")
     
     # 5. Renumera coluna "#" se existir
@@ -1043,26 +1399,11 @@ def process_restaurants_excel(input_path: str, output_path: Optional[str] = None
             record['#'] = idx
     
     # 6. Cria DataFrame final preservando todas as colunas originais
-    # Primeiro, cria um DataFrame com os registros processados
-    df_final = pd.DataFrame(records_with_blocks)
-    
-    # Garante que a coluna Bloco existe
-    if 'Bloco' not in df_final.columns:
-        df_final['Bloco'] = None
-    
-    # Preserva todas as colunas originais do DataFrame
-    # Adiciona colunas que possam estar faltando
-    for col in df.columns:
-        if col not in df_final.columns:
-            df_final[col] = None
-    
-    # Reordena colunas: # primeiro, depois Bloco, depois as demais na ordem original
+    # Ordem: # primeiro, depois Bloco, depois as demais na ordem original; um único reindex
+    # seleciona, reordena e cria vazias as colunas que faltarem
     original_cols = [col for col in df.columns if col not in ['#', 'Bloco']]
     final_cols = ['#'] + ['Bloco'] + original_cols
-    
-    # Garante que todas as colunas estejam presentes
-    available_cols = [col for col in final_cols if col in df_final.columns]
-    df_final = df_final[available_cols]
+    df_final = pd.DataFrame(records_with_blocks).reindex(columns=final_cols)
     
     # 7. Gera arquivo de saída
     if output_path is None:
@@ -1071,13 +1412,7 @@ def process_restaurants_excel(input_path: str, output_path: Optional[str] = None
     
     # Cria auditoria de deduplicação
     audit_dedup = audit_instagram + audit_address
-    df_audit_dedup = pd.DataFrame(audit_dedup) if audit_dedup else pd.DataFrame(columns=[
-        'Critério de Deduplicação', 'Linha Mantida', 'Linhas Removidas', 'Justificativa'
-    ])
-    
-    # Renomeia colunas da auditoria para português
-    if not df_audit_dedup.empty:
-        df_audit_dedup.columns = ['Critério de Deduplicação', 'Linha Mantida', 'Linhas Removidas', 'Justificativa']
+    df_audit_dedup = dedup_audit_dataframe(audit_dedup, restaurant_col, instagram_col, address_col)
     
     # Cria auditoria de clusters
     df_audit_clusters = pd.DataFrame(cluster_audit) if cluster_audit else pd.DataFrame(columns=[
@@ -1110,10 +1445,12 @@ def process_restaurants_excel(input_path: str, output_path: Optional[str] = None
         df_audit_clusters = df_audit_clusters.rename(columns=rename_map)
     
     # Salva arquivo Excel com múltiplas abas
-    with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-        df_final.to_excel(writer, sheet_name='Restaurantes', index=False)
-        df_audit_dedup.to_excel(writer, sheet_name='Auditoria Deduplicação', index=False)
-        df_audit_clusters.to_excel(writer, sheet_name='Auditoria Clusters (Agrupamento por Grupo/Rede)', index=False)
+    # Nome de aba: até 31 caracteres e sem "/"
+    write_excel_sheets(output_path, [
+        ('Restaurantes', df_final),
+        ('Auditoria Deduplicação', df_audit_dedup),
+        ('Auditoria Clusters (Grupo-Rede)', df_audit_clusters),
+    ])
     
     logger.info(f"Arquivo processado salvo em: {output_path}")
     
@@ -1186,23 +1523,17 @@ def process_restaurants_csv(input_path: str, output_path: Optional[str] = None)
 
     # Converte para lista de dicts (usando nomes internos únicos)
     records = df.to_dict("records")
+    original_records = records  # posição na lista = linha de `df`
     original_count = len(records)
     logger.info(f"[CSV] Processando {original_count} registros...")
 
     # Manutenção incremental: preserva blocos existentes (se existir coluna "Bloco" no template)
     existing_blocos_map: Dict[int, int] = {}
     if bloco_col:
-        for i, rec in enumerate(records):
-            v = rec.get(bloco_col, "")
-            if v is None:
-                continue
-            v = str(v).strip()
-            if not v:
-                continue
-            try:
-                existing_blocos_map[i] = int(float(v))
-            except (ValueError, TypeError):
-                continue
+        # Conversão vetorizada da coluna inteira; vazios e valores não numéricos ficam de fora
+        blocos = pd.to_numeric(df[bloco_col], errors="coerce").to_numpy(dtype=float)
+        valid = np.isfinite(blocos)
+        existing_blocos_map = dict(zip(np.flatnonzero(valid).tolist(), blocos[valid].astype(int).tolist()))
     max_existing_bloco = max(existing_blocos_map.values()) if existing_blocos_map else 0
 
     # 1) Deduplicação por Instagram idêntico (conservadora, auditável)
@@ -1232,17 +1563,31 @@ def process_restaurants_csv(input_path: str, output_path: Optional[str] = None)
         logger.info(f"[CSV] Após deduplicação por Endereço: {len(records)} registros")
 
     # 3) Clusters (sem exclusão)
+    frame = RestaurantFrame.from_records(records, restaurant_col, instagram_col, address_col)
     clusters = identify_clusters(
         records,
         restaurant_col=restaurant_col,
         instagram_col=instagram_col,
         address_col=address_col or "",
+        frame=frame,
     )
     logger.info(f"[CSV] Identificados {len(clusters)} clusters")
 
+    # A deduplicação devolve os próprios dicts de `records`, então a identidade de cada um leva
+    # à sua linha original em `df`
+    row_of = {id(rec): pos for pos, rec in enumerate(original_records)}
+
+    # Blocos existentes estão indexados pela linha de `df`; remapeia para as posições após a
+    # deduplicação (registros removidos levam o bloco junto)
+    existing_blocos_after_dedup: Dict[int, int] = {}
+    for new_idx, rec in enumerate(records):
+        bloco = existing_blocos_map.get(row_of[id(rec)])
+        if bloco is not None:
+            existing_blocos_after_dedup[new_idx] = bloco
+
     # 4) Blocos (entre 5 e 10 por bloco, SEM LIMITE no número total de blocos) preservando blocos existentes
     # SEMPRE atribui blocos a todos os registros automaticamente
-    records_with_blocks, cluster_audit = distribute_into_blocks(
+    records_with_blocks, cluster_audit, total_blocks = distribute_into_blocks(
         records,
         clusters,
         restaurant_col=restaurant_col,
@@ -1250,66 +1595,50 @@ def process_restaurants_csv(input_path: str, output_path: Optional[str] = None)
         address_col=address_col,
         max_block_size=10,
         min_block_size=5,
-        existing_blocos=existing_blocos_map if existing_blocos_map else None,
+        existing_blocos=existing_blocos_after_dedup if existing_blocos_after_dedup else None,
         start_block_num=max_existing_bloco + 1 if max_existing_bloco > 0 else 1,
+        frame=frame,
     )
     
     # Verifica que todos os registros receberam blocos
     records_without_blocks = [i for i, rec in enumerate(records_with_blocks) if 'Bloco' not in rec or rec.get('Bloco') is None]
     if records_without_blocks:
         logger.warning(f"[CSV] ATENÇÃO: {len(records_without_blocks)} registros não receberam blocos. Corrigindo...")
-        # Corrige atribuindo ao último bloco ou criando novo
-        max_bloco = max((rec.get('Bloco', 0) or 0 for rec in records_with_blocks), default=0)
+        # Corrige criando um novo bloco depois do último
+        total_blocks += 1
         for idx in records_without_blocks:
-            records_with_blocks[idx]['Bloco'] = max_bloco + 1
+            records_with_blocks[idx]['Bloco'] = total_blocks
     
-    total_blocks = max((rec.get('Bloco', 0) or 0 for rec in records_with_blocks), default=0)
     logger.info(f"[CSV] Distribuídos {len(records_with_blocks)} registros em {total_blocks} blocos (sem limite no número total de blocos)")
 
-    # 5) Atualiza coluna "#" em ordem sequencial (usa a coluna # do template se existir; senão cria)
-    if hash_col:
-        for i, rec in enumerate(records_with_blocks, start=1):
-            rec[hash_col] = str(i)
-    else:
+    # 5) Monta o DataFrame final direto das linhas mantidas de `df` (sem reconstruir a partir
+    # dos dicts), pelas linhas originais de `row_of`
+    kept_rows = [row_of[id(rec)] for rec in records_with_blocks]
+    df_final_internal = df.iloc[kept_rows].reset_index(drop=True)
+    blocos = [str(rec.get("Bloco", "")) for rec in records_with_blocks]
+
+    # Coluna "#" em ordem sequencial (usa a coluna # do template se existir; senão cria)
+    if not hash_col:
         # Cria uma coluna interna extra ao final
-        new_hash_internal = f"col_{len(headers):03d}"
-        internal_to_original[new_hash_internal] = "#"
+        hash_col = f"col_{len(headers):03d}"
+        internal_to_original[hash_col] = "#"
         headers = headers + ["#"]
         banners = banners + [""]
-        for i, rec in enumerate(records_with_blocks, start=1):
-            rec[new_hash_internal] = str(i)
-        hash_col = new_hash_internal
+    df_final_internal[hash_col] = [str(i) for i in range(1, len(records_with_blocks) + 1)]
 
-    # 6) Garante que a coluna "Bloco" exista (usa a do template se existir)
+    # 6) Garante que a coluna "Bloco" exista (usa a do template se existir) com o valor calculado
     if not bloco_col:
-        new_bloco_internal = f"col_{len(headers):03d}"
-        internal_to_original[new_bloco_internal] = "Bloco"
+        bloco_col = f"col_{len(headers):03d}"
+        internal_to_original[bloco_col] = "Bloco"
         headers = headers + ["Bloco"]
         banners = banners + [""]
-        for rec in records_with_blocks:
-            rec[new_bloco_internal] = str(rec.get("Bloco", ""))
-        bloco_col = new_bloco_internal
-    else:
-        # Copia o valor calculado para a coluna Bloco do template
-        for rec in records_with_blocks:
-            rec[bloco_col] = str(rec.get("Bloco", ""))
-    
-    # 7) Garante que a coluna "Cliente" exista no output final (já foi criada antes se não existia)
-    if cliente_col:
-        # Garante que todos os registros tenham a coluna cliente
-        for rec in records_with_blocks:
-            if cliente_col not in rec:
-                rec[cliente_col] = "não"
+    df_final_internal[bloco_col] = blocos
 
-    # 8) Reconstrói DataFrame final com mesma ordem e headers originais
-    df_final_internal = pd.DataFrame(records_with_blocks)
+    # 7) A coluna "Cliente" já existe em `df` (foi criada antes se não existia no template)
 
-    # garante todas as colunas internas originais presentes (mesma ordem)
+    # 8) Mesma ordem e headers originais (colunas internas que faltarem ficam vazias)
     desired_internal_order = list(internal_to_original.keys())
-    for col in desired_internal_order:
-        if col not in df_final_internal.columns:
-            df_final_internal[col] = ""
-    df_final_internal = df_final_internal[desired_internal_order]
+    df_final_internal = df_final_internal.reindex(columns=desired_internal_order, fill_value="")
 
     # troca nomes internos pelos headers originais (pode ter duplicados; Excel aceita)
     original_headers_ordered = [internal_to_original[c] for c in desired_internal_order]
@@ -1322,11 +1651,7 @@ def process_restaurants_csv(input_path: str, output_path: Optional[str] = None)
 
     # Auditoria Deduplicação
     audit_dedup = audit_instagram + audit_address
-    df_audit_dedup = pd.DataFrame(audit_dedup) if audit_dedup else pd.DataFrame(
-        columns=["Critério de Deduplicação", "Linha Mantida", "Linhas Removidas", "Justificativa"]
-    )
-    if not df_audit_dedup.empty and list(df_audit_dedup.columns) != ["Critério de Deduplicação", "Linha Mantida", "Linhas Removidas", "Justificativa"]:
-        df_audit_dedup.columns = ["Critério de Deduplicação", "Linha Mantida", "Linhas Removidas", "Justificativa"]
+    df_audit_dedup = dedup_audit_dataframe(audit_dedup, restaurant_col, instagram_col, address_col)
 
     # Auditoria Clusters
     df_audit_clusters = pd.DataFrame(cluster_audit) if cluster_audit else pd.DataFrame(
@@ -1349,10 +1674,12 @@ def process_restaurants_csv(input_path: str, output_path: Optional[str] = None)
             columns={"id_cluster": "ID do Cluster", "criterio_associacao": "Critério de Associação"}
         )
 
-    with pd.ExcelWriter(output_path, engine="openpyxl") as writer:
-        df_final_internal.to_excel(writer, sheet_name="Restaurantes", index=False)
-        df_audit_dedup.to_excel(writer, sheet_name="Auditoria Deduplicação", index=False)
-        df_audit_clusters.to_excel(writer, sheet_name="Auditoria Clusters (Agrupamento por Grupo/Rede)", index=False)
+    # Nome de aba: até 31 caracteres e sem "/"
+    write_excel_sheets(output_path, [
+        ("Restaurantes", df_final_internal),
+        ("Auditoria Deduplicação", df_audit_dedup),
+        ("Auditoria Clusters (Grupo-Rede)", df_audit_clusters),
+    ])
 
     logger.info(f"[CSV] Arquivo processado salvo em: {output_path}")
     return {
@@ -1362,12 +1689,26 @@ def process_restaurants_csv(input_path: str, output_path: Optional[str] = None)
         "final_count": len(records_with_blocks),
         "removed_count": original_count - len(records_with_blocks),
         "clusters_identified": len(clusters),
-        "blocks_created": int(max(rec.get("Bloco", 0) or 0 for rec in records_with_blocks)) if records_with_blocks else 0,
+        "blocks_created": int(total_blocks),
         "deduplication_audit_count": len(audit_dedup),
         "cluster_audit_count": len(cluster_audit),
     }
 
 
+def bloco_presence(restaurants: List[Any]) -> Tuple[bool, bool]:
+    """
+    Retorna (algum_tem_bloco, algum_sem_bloco) para um payload de restaurantes.
+    
+    Projeta apenas o campo "bloco" em uma Series e faz a checagem de nulo/vazio de forma
+    vetorizada (sem montar um DataFrame com todos os campos do payload).
+    """
+    blocos = pd.Series([r.get("bloco") for r in restaurants if isinstance(r, dict)], dtype=object)
+    if blocos.empty:
+        return False, False
+    missing = blocos.isna() | blocos.eq("")
+    return bool((~missing).any()), bool(missing.any())
+
+
 def assign_blocks_to_restaurants(restaurants: List[Dict[str, Any]], 
                                  start_block_num: int = 1) -> List[Dict[str, Any]]:
     """
@@ -1391,49 +1732,60 @@ def assign_blocks_to_restaurants(restaurants: List[Dict[str, Any]],
         start_block_num: Número inicial do bloco (padrão: 1)
     
     Returns:
-        Lista de restaurantes com blocos atribuídos (campo "bloco" sempre preenchido)
+        Lista de restaurantes com blocos atribuídos (campo "bloco" sempre preenchido).
+        Os dicts de entrada são atualizados no lugar, sem cópias.
     """
     if not restaurants:
         return restaurants
     
-    # Converte para o formato usado pelo processador
-    records = []
+    # Restaurantes que já têm bloco o preservam; só os demais passam pelo agrupamento
+    missing = []  # posições em `restaurants` sem bloco
+    max_existing = None
     for idx, rest in enumerate(restaurants):
-        record = {
+        bloco_existente = rest.get("bloco")
+        if bloco_existente is not None and isinstance(bloco_existente, (int, float)):
+            rest["bloco"] = int(bloco_existente)
+            if max_existing is None or rest["bloco"] > max_existing:
+                max_existing = rest["bloco"]
+        else:
+            missing.append(idx)
+    
+    # Caminho rápido: reingestão de arquivo já processado, nada a agrupar
+    if not missing:
+        logger.info(f"Todos os {len(restaurants)} restaurantes já têm bloco; agrupamento ignorado")
+        return restaurants
+    
+    # Os novos blocos começam depois de todos os existentes (no banco e no próprio lote), então
+    # os registros que já têm bloco nunca dividem bloco com os novos e não precisam ser agrupados
+    if max_existing is not None:
+        actual_start_block = max(start_block_num, max_existing + 1)
+    else:
+        actual_start_block = start_block_num
+    
+    # Converte para o formato usado pelo processador: os registros levam só os campos lidos
+    # pelo agrupamento
+    records = []
+    for idx in missing:
+        rest = restaurants[idx]
+        records.append({
             "restaurant": rest.get("name", ""),
             "instagram": rest.get("instagram_username", ""),
             "address": "",  # Endereço não está disponível no bulk, mas não impede o processamento
-            "bloco_existente": rest.get("bloco"),  # Preserva bloco existente se houver
-            "cliente": rest.get("cliente", False),
-            "_original_index": idx,  # Para mapear de volta
-            "_original_data": rest,  # Preserva dados originais
-        }
-        records.append(record)
+            "_original_index": idx,  # Posição em `restaurants`, para mapear de volta
+        })
     
     # Identifica clusters (mesmo grupo/rede/dono)
+    frame = RestaurantFrame.from_records(records, "restaurant", "instagram", "address")
     clusters = identify_clusters(
         records,
         restaurant_col="restaurant",
         instagram_col="instagram",
-        address_col="address"
+        address_col="address",
+        frame=frame
     )
     
-    # Preserva blocos existentes se houver
-    existing_blocos_map = {}
-    for idx, rec in enumerate(records):
-        bloco_existente = rec.get("bloco_existente")
-        if bloco_existente is not None and isinstance(bloco_existente, (int, float)):
-            existing_blocos_map[idx] = int(bloco_existente)
-    
-    # Determina número inicial do bloco
-    if existing_blocos_map:
-        max_existing = max(existing_blocos_map.values())
-        actual_start_block = max_existing + 1
-    else:
-        actual_start_block = start_block_num
-    
     # Distribui em blocos (entre 5 e 10 registros por bloco quando possível)
-    records_with_blocks, _ = distribute_into_blocks(
+    records_with_blocks, _, max_bloco = distribute_into_blocks(
         records,
         clusters,
         restaurant_col="restaurant",
@@ -1441,27 +1793,20 @@ def assign_blocks_to_restaurants(restaurants: List[Dict[str, Any]],
         address_col="address",
         max_block_size=10,
         min_block_size=5,
-        existing_blocos=existing_blocos_map if existing_blocos_map else None,
-        start_block_num=actual_start_block
+        start_block_num=actual_start_block,
+        frame=frame
     )
     
-    # Converte de volta para o formato original e atribui blocos
-    result = []
+    # Atribui os blocos de volta aos dicts originais (no lugar, sem cópias)
     for rec in records_with_blocks:
-        original = rec.get("_original_data", {})
         bloco_atribuido = rec.get("Bloco")
-        
         # Garante que o bloco está preenchido
         if bloco_atribuido is None:
-            # Se não foi atribuído, usa o existente ou atribui ao próximo bloco disponível
-            bloco_atribuido = original.get("bloco") or actual_start_block
-        
-        # Cria novo dict com bloco atribuído
-        new_rest = dict(original)
-        new_rest["bloco"] = int(bloco_atribuido)
-        result.append(new_rest)
+            bloco_atribuido = actual_start_block
+        restaurants[rec["_original_index"]]["bloco"] = int(bloco_atribuido)
     
-    max_bloco = max((r.get('bloco', 0) or 0) for r in result) if result else 0
-    logger.info(f"Atribuídos blocos a {len(result)} restaurantes. Total de blocos: {max_bloco}")
+    if max_existing is not None:
+        max_bloco = max(max_bloco, max_existing)
+    logger.info(f"Atribuídos blocos a {len(restaurants)} restaurantes. Total de blocos: {max_bloco}")
     
-    return result
+    return restaurants
@@ -1,3 +1,4 @@
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from .database import SessionLocal
 
@@ -19,7 +20,8 @@ def get_persona_by_name(db: Session, name: str):
     return db.query(Persona).filter(Persona.name == name).first()
 
 
-def get_next_phrase_order(db: Session, persona_id: int) -> int:
+def get_next_phrase_order(db: Session) -> int:
+    # Frases são globais (sem persona_id); MAX usa o índice de Phrase.order
     from .models import Phrase
-    max_order = db.query(Phrase.order).filter(Phrase.persona_id == persona_id).order_by(Phrase.order.desc()).first()
-    return (max_order[0] + 1) if max_order and max_order[0] is not None else 1
\ No newline at end of file
+    max_order = db.query(func.max(Phrase.order)).scalar()
+    return (max_order + 1) if max_order is not None else 1
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 
 SQLITE_DATABASE_URL = "sqlite:///./db.sqlite"
@@ -7,6 +7,27 @@ engine = create_engine(
     SQLITE_DATABASE_URL,
     connect_args={"check_same_thread": False},
     echo=False,
+    # Lotes maiores por INSERT nos endpoints /bulk (executemany via insertmanyvalues)
+    insertmanyvalues_page_size=1000,
+    # Conexões reaproveitadas entre requests (o threadpool do FastAPI atende várias ao mesmo tempo)
+    pool_size=10,
+    max_overflow=20,
 )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
\ No newline at end of file
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL deixa leituras concorrentes com as escritas e, junto com
+    # synchronous=NORMAL, evita um fsync por commit (log_sent_message grava muito)
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.close()
+
+
+# expire_on_commit=False: objetos continuam carregados após o commit, sem um SELECT extra
+# no próximo acesso a atributo (ex.: ao serializar a resposta)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, expire_on_commit=False)
\ No newline at end of file
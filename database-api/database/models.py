@@ -8,6 +8,7 @@ from sqlalchemy import (
     ForeignKey,
     func,
     Boolean,
+    Index,
 )
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
@@ -59,7 +60,7 @@ class Phrase(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     text = Column(Text, nullable=False)
-    order = Column(Integer, nullable=False)  # ordem dentro da persona (1, 2, 3...)
+    order = Column(Integer, nullable=False, index=True)  # ordem dentro da persona (1, 2, 3...)
     cliente = Column(Boolean, nullable=False, default=False)
 
     # Relacionamentos
@@ -90,6 +91,11 @@ class MessageLog(Base):
     persona = relationship("Persona", back_populates="messages")
     phrase = relationship("Phrase", back_populates="messages")
 
+    # Última mensagem de um restaurante (/last-message) vira um único seek no índice
+    __table_args__ = (
+        Index("ix_msglog_rest_sent", "restaurant_id", sent_at.desc()),
+    )
+
 
 class FollowStatus(Base):
     __tablename__ = "follow_status"
@@ -2,13 +2,21 @@ from fastapi import FastAPI, HTTPException, Depends, WebSocket, WebSocketDisconn
 from fastapi.responses import Response
 
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List, Optional
-from sqlalchemy import func
+from sqlalchemy.orm import Session, raiseload
+from typing import Any, List, Optional
+from sqlalchemy import exists, func, insert, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 import asyncio
+import logging
+import os
+import threading
+import time
 from collections import deque
+from contextlib import asynccontextmanager
 import csv
 import io
+import orjson
 from datetime import datetime, timedelta
 from openpyxl import Workbook
 
@@ -35,12 +43,42 @@ from schemas.phrase import (
 
 from database.database import engine
 
-Base.metadata.create_all(bind=engine)
+logger = logging.getLogger(__name__)
+
+# Cria tabelas/índices na subida da API (não no import). Com AUTO_CREATE_SCHEMA=0 o passo é
+# pulado, para quando o schema já é gerenciado fora daqui
+AUTO_CREATE_SCHEMA = os.getenv("AUTO_CREATE_SCHEMA", "1") == "1"
+
+
+def _init_schema():
+    Base.metadata.create_all(bind=engine)
+    # create_all não adiciona índices novos a tabelas que já existem no db.sqlite
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Prepara o schema e mantém a task que agrupa os eventos de websocket em lotes enquanto a API estiver no ar."""
+    global _loop, _event_queue
+    if AUTO_CREATE_SCHEMA:
+        _init_schema()
+    _loop = asyncio.get_running_loop()
+    # A fila fica presa ao loop do primeiro get() bloqueante: uma nova por lifespan
+    _event_queue = asyncio.Queue(maxsize=EVENT_QUEUE_MAXSIZE)
+    flusher = asyncio.create_task(_event_flusher())
+    try:
+        yield
+    finally:
+        flusher.cancel()
+
 
 app = FastAPI(
     title="Database API - Instagram Automation",
     description="API isolada responsável apenas pelo banco SQLite",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -52,61 +90,168 @@ app.add_middleware(
 )
 
 
+def _json_response(content: Any, status_code: int = 200) -> Response:
+    """Resposta JSON serializada com orjson (bytes direto no corpo), para listas grandes sem response_model."""
+    return Response(content=orjson.dumps(content), status_code=status_code, media_type="application/json")
+
+
 # ======================
 # ESTADO EM MEMÓRIA PARA WEBSOCKET
 # ======================
 
-active_websockets: list[WebSocket] = []
-dm_stats = {"total": 0, "success": 0, "fail": 0}
-recent_events: deque[dict] = deque(maxlen=50)
+# Cada socket conectado tem sua fila de saída, esvaziada por uma task própria:
+# um cliente lento não atrasa os demais e o broadcast nunca bloqueia a rota.
+WS_QUEUE_MAXSIZE = 256
 
+active_websockets: dict[WebSocket, asyncio.Queue] = {}
+dm_stats = {"total": 0, "success": 0, "fail": 0}
+# Histórico para novas conexões, guardado já serializado e limitado em quantidade e em
+# bytes: um log ou frase gigante não fica preso na memória nem em todo "history"
+RECENT_EVENTS_MAX = 50
+RECENT_EVENT_MAX_BYTES = 16 * 1024
+RECENT_EVENTS_MAX_BYTES = 256 * 1024
+EVENT_TEXT_MAX_CHARS = 2000
+recent_events: deque[bytes] = deque()
+_recent_events_bytes = 0
+# Mensagem "history" já serializada; refeita só depois que recent_events mudar
+_history_text: Optional[str] = None
+
+# Eventos (system_log, dm_log, emit) aguardando o próximo flush em lote: sob carga vão
+# vários por frame ({"type": "batch"}) em vez de um frame por evento. O flusher dorme
+# até chegar um evento e só então espera EVENT_FLUSH_INTERVAL juntando os seguintes.
+EVENT_FLUSH_INTERVAL = 0.02
+EVENT_BATCH_MAX = 256
+EVENT_QUEUE_MAXSIZE = 10000
+_event_queue: asyncio.Queue = asyncio.Queue(maxsize=EVENT_QUEUE_MAXSIZE)
+
+# Loop do servidor, capturado no lifespan: rotas síncronas (threadpool) agendam nele
+# tudo que mexe nas filas dos websockets, que não são thread-safe
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _broadcast_event(event: dict):
+    """Enfileira um evento JSON para todos os websockets conectados.
+
+    O evento é serializado uma única vez; se a fila de um socket estiver cheia,
+    o evento mais antigo dela é descartado.
+    """
+    # Só em DEBUG: roda a cada evento (cada DM e cada linha de log)
+    logger.debug("[WS BROADCAST] -> sending event type=%s to %d sockets", event.get("type"), len(active_websockets))
 
-async def _broadcast_event(event: dict):
-    """Envia um evento JSON para todos os websockets conectados.
+    # Serializado uma vez com orjson; enviado como texto porque o frontend faz JSON.parse
+    text = orjson.dumps(event).decode()
+    for queue in active_websockets.values():
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(text)
 
-    Remove conexões quebradas ao detectar erros de envio.
-    """
-    # Log de envio para facilitar o debug (aparecerá no stdout do uvicorn)
-    try:
-        print(f"[WS BROADCAST] -> sending event type={event.get('type')} to {len(active_websockets)} sockets")
-    except Exception:
-        pass
 
-    dead: list[WebSocket] = []
-    for ws in list(active_websockets):
+async def _ws_sender(websocket: WebSocket, queue: asyncio.Queue):
+    """Consome a fila de um socket; remove a conexão ao detectar erro de envio."""
+    while True:
+        text = await queue.get()
         try:
-            await ws.send_json(event)
+            await websocket.send_text(text)
         except Exception:
             # Log falha de envio e marca conexão como morta
             try:
                 print("[WS BROADCAST] -> failed to send to a socket, removing")
             except Exception:
                 pass
-            dead.append(ws)
-    for ws in dead:
-        if ws in active_websockets:
-            active_websockets.remove(ws)
+            active_websockets.pop(websocket, None)
+            return
 
 
 @app.websocket("/automation/ws")
 async def automation_ws(websocket: WebSocket):
     await websocket.accept()
-    active_websockets.append(websocket)
+    # Registra a fila antes do estado inicial: eventos que chegarem nesse meio-tempo
+    # ficam enfileirados e saem depois do histórico
+    queue: asyncio.Queue = asyncio.Queue(maxsize=WS_QUEUE_MAXSIZE)
+    active_websockets[websocket] = queue
 
     # Envia estado inicial de contadores
     await websocket.send_json({"type": "stats", "stats": dm_stats})
 
     # Envia histórico recente de eventos (até 50)
     if recent_events:
-        await websocket.send_json({"type": "history", "items": list(recent_events)})
+        await websocket.send_text(_history_message())
 
+    sender = asyncio.create_task(_ws_sender(websocket, queue))
     try:
         while True:
             # Mantém conexão viva; ignoramos mensagens do cliente por enquanto
             await websocket.receive_text()
     except WebSocketDisconnect:
-        if websocket in active_websockets:
-            active_websockets.remove(websocket)
+        pass
+    finally:
+        active_websockets.pop(websocket, None)
+        sender.cancel()
+
+
+async def _event_flusher():
+    """Envia os eventos acumulados, em ordem, num único frame; parado enquanto a fila está vazia."""
+    while True:
+        batch = [await _event_queue.get()]
+        # Janela curta para juntar os eventos que chegam logo em seguida
+        await asyncio.sleep(EVENT_FLUSH_INTERVAL)
+        while not _event_queue.empty() and len(batch) < EVENT_BATCH_MAX:
+            batch.append(_event_queue.get_nowait())
+        if active_websockets:
+            _broadcast_event({"type": "batch", "items": batch})
+
+
+def _enqueue_event(event: dict):
+    try:
+        _event_queue.put_nowait(event)
+    except asyncio.QueueFull:
+        # Rajada maior que a fila: descarta o evento (continua no recent_events)
+        pass
+
+
+def _encode_bounded(event: dict) -> bytes:
+    """Serializa o evento; acima de RECENT_EVENT_MAX_BYTES corta (no próprio evento) os textos livres."""
+    encoded = orjson.dumps(event)
+    if len(encoded) <= RECENT_EVENT_MAX_BYTES:
+        return encoded
+    for holder, field in ((event, "message"), (event, "line"), (event.get("phrase"), "text")):
+        if isinstance(holder, dict) and isinstance(holder.get(field), str) and len(holder[field]) > EVENT_TEXT_MAX_CHARS:
+            holder[field] = holder[field][:EVENT_TEXT_MAX_CHARS] + "…"
+    return orjson.dumps(event)
+
+
+def _remember_events(*events: dict):
+    """Adiciona eventos ao buffer de recentes e invalida o histórico serializado."""
+    global _history_text, _recent_events_bytes
+    for event in events:
+        encoded = _encode_bounded(event)
+        if len(encoded) > RECENT_EVENT_MAX_BYTES:
+            # Mesmo cortado continua grande demais: vai aos websockets, mas não ao histórico
+            continue
+        recent_events.append(encoded)
+        _recent_events_bytes += len(encoded)
+        while len(recent_events) > RECENT_EVENTS_MAX or _recent_events_bytes > RECENT_EVENTS_MAX_BYTES:
+            _recent_events_bytes -= len(recent_events.popleft())
+    _history_text = None
+
+
+def _history_message() -> str:
+    """Histórico enviado a cada nova conexão, serializado uma vez por mudança do buffer."""
+    global _history_text
+    if _history_text is None:
+        _history_text = (b'{"type":"history","items":[' + b",".join(recent_events) + b"]}").decode()
+    return _history_text
+
+
+def _system_log_event(payload: dict) -> dict:
+    return {
+        "type": "system_log",
+        "level": payload.get("level", "INFO"),
+        "logger": payload.get("logger"),
+        "message": payload.get("message"),
+        "created_at": payload.get("created_at"),
+        "stats": dm_stats,
+    }
 
 
 @app.post("/automation/logline")
@@ -115,29 +260,32 @@ async def automation_logline(payload: dict):
 
     Não persiste em banco; é apenas para observabilidade em tempo real no frontend.
     """
-    message = payload.get("message")
-    level = payload.get("level", "INFO")
-    logger_name = payload.get("logger")
-    created_at = payload.get("created_at")
-
-    event = {
-        "type": "system_log",
-        "level": level,
-        "logger": logger_name,
-        "message": message,
-        "created_at": created_at,
-        "stats": dm_stats,
-    }
+    event = _system_log_event(payload)
 
     # adiciona ao buffer de eventos recentes
-    recent_events.append(event)
+    _remember_events(event)
 
     if active_websockets:
-        asyncio.create_task(_broadcast_event(event))
+        _enqueue_event(event)
 
     return {"status": "ok"}
 
 
+@app.post("/automation/logline/bulk")
+async def automation_logline_bulk(payload: List[dict]):
+    """Versão em lote de /automation/logline: o backend agrupa linhas de log em um único POST."""
+    events = [_system_log_event(item) for item in payload if isinstance(item, dict)]
+
+    # adiciona ao buffer de eventos recentes
+    _remember_events(*events)
+
+    if active_websockets:
+        for event in events:
+            _enqueue_event(event)
+
+    return {"status": "ok", "received": len(events)}
+
+
 @app.post("/automation/emit")
 async def automation_emit(payload: dict):
     """Recebe um evento pronto (ex: `dm_log`) e envia para todos os WebSockets.
@@ -161,11 +309,11 @@ async def automation_emit(payload: dict):
     event["stats"] = dict(dm_stats)  # Envia uma cópia para evitar referências
 
     # Adiciona ao buffer de eventos recentes
-    recent_events.append(event)
+    _remember_events(event)
 
-    # Envia para todos os clientes conectados
+    # Envia para todos os clientes conectados no próximo lote
     if active_websockets:
-        asyncio.create_task(_broadcast_event(event))
+        _enqueue_event(event)
 
     return {"status": "emitted", "stats": dm_stats}
 
@@ -174,8 +322,41 @@ async def automation_emit(payload: dict):
 # ROTAS - RESTAURANTES
 # ======================
 @app.get("/restaurants/", response_model=List[RestaurantOut])
-def list_restaurants(skip: int = 0, limit: int = 1000, db: Session = Depends(get_db)):
-    return db.query(Restaurant).offset(skip).limit(limit).all()
+def list_restaurants(
+    skip: int = 0,
+    limit: int = 1000,
+    after_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    """Lista restaurantes em ordem de id.
+
+    Seleciona só as colunas do RestaurantOut (sem montar objetos ORM) e lê o
+    resultado em lotes. Com ``after_id`` a paginação é por keyset (id > after_id),
+    que não degrada em páginas profundas como ``skip``/OFFSET.
+    """
+    stmt = select(
+        Restaurant.id,
+        Restaurant.instagram_username,
+        Restaurant.name,
+        Restaurant.bloco,
+        Restaurant.ultima_persona,
+        Restaurant.ultima_frase_num,
+        Restaurant.ultima_frase_text,
+        Restaurant.cliente,
+        Restaurant.created_at,
+    ).order_by(Restaurant.id).limit(limit)
+    if after_id is not None:
+        stmt = stmt.where(Restaurant.id > after_id)
+    elif skip:
+        stmt = stmt.offset(skip)
+    return list(db.execute(stmt).yield_per(200))
+
+
+@app.get("/restaurants/max_bloco")
+def get_max_restaurant_bloco(db: Session = Depends(get_db)):
+    """Retorna o maior bloco já atribuído (0 se nenhum), sem carregar a tabela inteira."""
+    max_bloco = db.query(func.max(Restaurant.bloco)).scalar()
+    return {"max": max_bloco or 0}
 
 
 @app.get("/restaurants/{restaurant_id}", response_model=RestaurantOut)
@@ -188,10 +369,6 @@ def get_restaurant(restaurant_id: int, db: Session = Depends(get_db)):
 
 @app.post("/restaurants/", response_model=RestaurantOut, status_code=201)
 def create_restaurant(restaurant_in: RestaurantCreate, db: Session = Depends(get_db)):
-    existing = db.query(Restaurant).filter(Restaurant.instagram_username == restaurant_in.instagram_username).first()
-    if existing:
-        raise HTTPException(status_code=400, detail="Já existe um restaurante com esse instagram_username")
-
     db_restaurant = Restaurant(
         instagram_username=restaurant_in.instagram_username,
         name=restaurant_in.name,
@@ -199,8 +376,12 @@ def create_restaurant(restaurant_in: RestaurantCreate, db: Session = Depends(get
         cliente=restaurant_in.cliente,
     )
     db.add(db_restaurant)
-    db.commit()
-    db.refresh(db_restaurant)
+    # A constraint UNIQUE de instagram_username faz a checagem de duplicata
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Já existe um restaurante com esse instagram_username")
     return db_restaurant
 
 
@@ -213,45 +394,37 @@ def bulk_create_restaurants(restaurants_in: List[RestaurantCreate], db: Session
     if not restaurants_in:
         return {"created": 0, "skipped": 0, "created_items": []}
     
-    # Busca todos os usernames existentes de uma vez
-    usernames_to_check = [r.instagram_username for r in restaurants_in]
-    existing_restaurants = db.query(Restaurant).filter(
-        Restaurant.instagram_username.in_(usernames_to_check)
-    ).all()
-    existing_usernames = {r.instagram_username for r in existing_restaurants}
-    
-    # Filtra apenas os restaurantes que não existem
-    restaurants_to_create = []
-    skipped_count = 0
-    
-    for r in restaurants_in:
-        if r.instagram_username in existing_usernames:
-            skipped_count += 1
-            continue
-        restaurants_to_create.append(
-            Restaurant(
-                instagram_username=r.instagram_username,
-                name=r.name,
-                bloco=r.bloco,
-                cliente=r.cliente,
-            )
-        )
-        existing_usernames.add(r.instagram_username)  # Evita duplicatas dentro do próprio batch
-    
-    if not restaurants_to_create:
-        return {"created": 0, "skipped": skipped_count, "created_items": []}
-    
-    # Insere todos em uma única operação de bulk insert
-    db.bulk_save_objects(restaurants_to_create)
-    db.commit()
+    # Sem SELECT prévio com IN gigante: o índice UNIQUE descarta, via ON CONFLICT DO NOTHING,
+    # tanto o que já existe no banco quanto repetições dentro do próprio batch (vale a primeira)
+    restaurants_to_create = [
+        {
+            "instagram_username": r.instagram_username,
+            "name": r.name,
+            "bloco": r.bloco,
+            "cliente": r.cliente,
+        }
+        for r in restaurants_in
+    ]
     
-    # Busca os IDs dos restaurantes criados
-    created_usernames = [r.instagram_username for r in restaurants_to_create]
-    created_restaurants = db.query(Restaurant).filter(
-        Restaurant.instagram_username.in_(created_usernames)
+    # Insere todos em um único INSERT executemany (insertmanyvalues); o RETURNING devolve só
+    # as linhas realmente inseridas, na ordem da entrada, sem um SELECT depois
+    created_restaurants = db.execute(
+        sqlite_insert(Restaurant)
+        .on_conflict_do_nothing()
+        .returning(
+            Restaurant.id,
+            Restaurant.instagram_username,
+            Restaurant.name,
+            Restaurant.bloco,
+            Restaurant.cliente,
+            sort_by_parameter_order=True,
+        ),
+        restaurants_to_create,
     ).all()
+    db.commit()
+    skipped_count = len(restaurants_in) - len(created_restaurants)
     
-    return {
+    return _json_response({
         "created": len(created_restaurants),
         "skipped": skipped_count,
         "created_items": [
@@ -264,7 +437,7 @@ def bulk_create_restaurants(restaurants_in: List[RestaurantCreate], db: Session
             }
             for r in created_restaurants
         ]
-    }
+    }, status_code=201)
 
 
 @app.put("/restaurants/{restaurant_id}", response_model=RestaurantOut)
@@ -274,13 +447,6 @@ def update_restaurant(restaurant_id: int, restaurant_in: RestaurantUpdate, db: S
         raise HTTPException(status_code=404, detail="Restaurante não encontrado")
 
     if restaurant_in.instagram_username is not None:
-        existing = (
-            db.query(Restaurant)
-            .filter(Restaurant.instagram_username == restaurant_in.instagram_username, Restaurant.id != restaurant_id)
-            .first()
-        )
-        if existing:
-            raise HTTPException(status_code=400, detail="Já existe outro restaurante com esse instagram_username")
         restaurant.instagram_username = restaurant_in.instagram_username
 
     if restaurant_in.name is not None:
@@ -289,15 +455,19 @@ def update_restaurant(restaurant_id: int, restaurant_in: RestaurantUpdate, db: S
         restaurant.bloco = int(restaurant_in.bloco)
     restaurant.cliente = restaurant_in.cliente
 
-    db.commit()
-    db.refresh(restaurant)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Já existe outro restaurante com esse instagram_username")
+    _invalidate_cached_entity("restaurant", restaurant_id)
     return restaurant
 
 
 @app.delete("/restaurants/{restaurant_id}", status_code=204)
 def delete_restaurant(restaurant_id: int, db: Session = Depends(get_db)):
-    restaurant = db.query(Restaurant).filter(Restaurant.id == restaurant_id).first()
-    if not restaurant:
+    # Só precisa saber se existe: EXISTS não carrega a linha nem a coloca na sessão
+    if not db.query(exists().where(Restaurant.id == restaurant_id)).scalar():
         raise HTTPException(status_code=404, detail="Restaurante não encontrado")
 
     # Deleta registros relacionados em MessageLog
@@ -306,8 +476,9 @@ def delete_restaurant(restaurant_id: int, db: Session = Depends(get_db)):
     # Deleta registros relacionados em FollowStatus
     db.query(FollowStatus).filter(FollowStatus.restaurant_id == restaurant_id).delete()
 
-    db.delete(restaurant)
+    db.query(Restaurant).filter(Restaurant.id == restaurant_id).delete()
     db.commit()
+    _invalidate_cached_entity("restaurant", restaurant_id)
     return {"status": "deleted"}
 
 
@@ -326,6 +497,7 @@ def delete_all_restaurants(db: Session = Depends(get_db)):
     # Deleta restaurantes
     db.query(Restaurant).delete(synchronize_session=False)
     db.commit()
+    _invalidate_cached_entity("restaurant")
 
     return {"deleted": deleted_restaurants}
 
@@ -335,27 +507,24 @@ def delete_all_restaurants(db: Session = Depends(get_db)):
 # ======================
 @app.get("/personas/", response_model=List[PersonaOut])
 def list_personas(db: Session = Depends(get_db)):
-    return db.query(Persona).all()
+    # PersonaOut não usa relacionamentos; raiseload evita N+1 silencioso na serialização
+    return db.query(Persona).options(raiseload("*")).all()
 
 
 @app.post("/personas/", response_model=PersonaOut)
 def create_persona(persona: PersonaCreate, db: Session = Depends(get_db)):
-    # Verifica se já existe uma persona com esse nome ou username
-    existing = db.query(Persona).filter(
-        (Persona.name == persona.name) |
-        (Persona.instagram_username == persona.instagram_username)
-    ).first()
-    if existing:
-        raise HTTPException(status_code=400, detail="Persona com este nome ou username já existe")
-
     db_persona = Persona(
         name=persona.name,
         instagram_username=persona.instagram_username,
         instagram_password=persona.instagram_password
     )
     db.add(db_persona)
-    db.commit()
-    db.refresh(db_persona)
+    # Nome e username são UNIQUE no banco; duplicata vira IntegrityError no commit
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Persona com este nome ou username já existe")
     return db_persona
 
 
@@ -368,50 +537,33 @@ def bulk_create_personas(personas_in: List[PersonaCreate], db: Session = Depends
     if not personas_in:
         return {"created": 0, "skipped": 0, "created_items": []}
     
-    # Busca todos os nomes e usernames existentes de uma vez
-    names_to_check = [p.name for p in personas_in]
-    usernames_to_check = [p.instagram_username for p in personas_in]
+    # Conflitos de name ou instagram_username, com o banco ou dentro do próprio batch, são
+    # descartados pelos índices UNIQUE via ON CONFLICT DO NOTHING (vale a primeira ocorrência)
+    personas_to_create = [
+        {
+            "name": p.name,
+            "instagram_username": p.instagram_username,
+            "instagram_password": p.instagram_password,
+        }
+        for p in personas_in
+    ]
     
-    existing_personas = db.query(Persona).filter(
-        (Persona.name.in_(names_to_check)) |
-        (Persona.instagram_username.in_(usernames_to_check))
+    # Insere todos em um único INSERT executemany (insertmanyvalues) com RETURNING dos IDs
+    created_personas = db.execute(
+        sqlite_insert(Persona)
+        .on_conflict_do_nothing()
+        .returning(
+            Persona.id,
+            Persona.name,
+            Persona.instagram_username,
+            sort_by_parameter_order=True,
+        ),
+        personas_to_create,
     ).all()
-    
-    existing_names = {p.name for p in existing_personas}
-    existing_usernames = {p.instagram_username for p in existing_personas}
-    
-    # Filtra apenas as personas que não existem
-    personas_to_create = []
-    skipped_count = 0
-    
-    for p in personas_in:
-        if p.name in existing_names or p.instagram_username in existing_usernames:
-            skipped_count += 1
-            continue
-        personas_to_create.append(
-            Persona(
-                name=p.name,
-                instagram_username=p.instagram_username,
-                instagram_password=p.instagram_password,
-            )
-        )
-        existing_names.add(p.name)
-        existing_usernames.add(p.instagram_username)  # Evita duplicatas dentro do próprio batch
-    
-    if not personas_to_create:
-        return {"created": 0, "skipped": skipped_count, "created_items": []}
-    
-    # Insere todos em uma única operação de bulk insert
-    db.bulk_save_objects(personas_to_create)
     db.commit()
+    skipped_count = len(personas_in) - len(created_personas)
     
-    # Busca os IDs das personas criadas
-    created_usernames = [p.instagram_username for p in personas_to_create]
-    created_personas = db.query(Persona).filter(
-        Persona.instagram_username.in_(created_usernames)
-    ).all()
-    
-    return {
+    return _json_response({
         "created": len(created_personas),
         "skipped": skipped_count,
         "created_items": [
@@ -422,7 +574,7 @@ def bulk_create_personas(personas_in: List[PersonaCreate], db: Session = Depends
             }
             for p in created_personas
         ]
-    }
+    }, status_code=201)
 
 
 @app.get("/personas/{persona_id}", response_model=PersonaOut)
@@ -440,37 +592,29 @@ def update_persona(persona_id: int, persona_in: PersonaUpdate, db: Session = Dep
         raise HTTPException(status_code=404, detail="Persona não encontrada")
 
     if persona_in.name is not None:
-        existing_by_name = (
-            db.query(Persona)
-            .filter(Persona.name == persona_in.name, Persona.id != persona_id)
-            .first()
-        )
-        if existing_by_name:
-            raise HTTPException(status_code=400, detail="Já existe outra persona com esse nome")
         persona.name = persona_in.name
 
     if persona_in.instagram_username is not None:
-        existing_by_username = (
-            db.query(Persona)
-            .filter(Persona.instagram_username == persona_in.instagram_username, Persona.id != persona_id)
-            .first()
-        )
-        if existing_by_username:
-            raise HTTPException(status_code=400, detail="Já existe outra persona com esse username")
         persona.instagram_username = persona_in.instagram_username
 
     if persona_in.instagram_password is not None:
         persona.instagram_password = persona_in.instagram_password
 
-    db.commit()
-    db.refresh(persona)
+    try:
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        # O SQLite informa a coluna violada: "UNIQUE constraint failed: personas.name"
+        if "personas.name" in str(e.orig):
+            raise HTTPException(status_code=400, detail="Já existe outra persona com esse nome")
+        raise HTTPException(status_code=400, detail="Já existe outra persona com esse username")
+    _invalidate_cached_entity("persona", persona_id)
     return persona
 
 
 @app.delete("/personas/{persona_id}", status_code=204)
 def delete_persona(persona_id: int, db: Session = Depends(get_db)):
-    persona = db.query(Persona).filter(Persona.id == persona_id).first()
-    if not persona:
+    if not db.query(exists().where(Persona.id == persona_id)).scalar():
         raise HTTPException(status_code=404, detail="Persona não encontrada")
 
     # Deleta registros relacionados em MessageLog
@@ -479,8 +623,9 @@ def delete_persona(persona_id: int, db: Session = Depends(get_db)):
     # Deleta registros relacionados em FollowStatus
     db.query(FollowStatus).filter(FollowStatus.persona_id == persona_id).delete()
 
-    db.delete(persona)
+    db.query(Persona).filter(Persona.id == persona_id).delete()
     db.commit()
+    _invalidate_cached_entity("persona", persona_id)
     return {"status": "deleted"}
 
 
@@ -498,6 +643,7 @@ def delete_all_personas(db: Session = Depends(get_db)):
 
     db.query(Persona).delete(synchronize_session=False)
     db.commit()
+    _invalidate_cached_entity("persona")
 
     return {"deleted": deleted_personas}
 
@@ -513,7 +659,7 @@ def delete_all_personas(db: Session = Depends(get_db)):
 @app.get("/phrases/", response_model=List[GlobalPhraseOut])
 def list_phrases(db: Session = Depends(get_db)):
     """Lista todas as frases; frases são entidades independentes (não estão atreladas a personas)."""
-    phrases = db.query(Phrase).order_by(Phrase.order).all()
+    phrases = db.query(Phrase).options(raiseload("*")).order_by(Phrase.order).all()
     return phrases
 
 
@@ -535,7 +681,6 @@ def create_global_phrase(phrase_in: GlobalPhraseCreate, db: Session = Depends(ge
     )
     db.add(db_phrase)
     db.commit()
-    db.refresh(db_phrase)
     return db_phrase
 
 
@@ -573,45 +718,40 @@ def bulk_create_phrases(phrases_in: List[GlobalPhraseCreate], db: Session = Depe
             skipped_count += 1
             continue
         phrases_to_create.append(
-            Phrase(
-                text=p.text,
-                order=p.order,
-                cliente=p.cliente,
-            )
+            {
+                "text": p.text,
+                "order": p.order,
+                "cliente": p.cliente,
+            }
         )
         existing_keys.add(key)  # Evita duplicatas dentro do próprio batch
     
     if not phrases_to_create:
         return {"created": 0, "skipped": skipped_count, "created_items": []}
     
-    # Insere todos em uma única operação de bulk insert
-    db.bulk_save_objects(phrases_to_create)
-    db.commit()
-    
-    # Busca os IDs das frases criadas
-    created_phrases = db.query(Phrase).filter(
-        Phrase.text.in_([p.text for p in phrases_to_create])
+    # Insere todos em um único INSERT executemany (insertmanyvalues) com RETURNING dos IDs
+    created_phrases = db.execute(
+        insert(Phrase).returning(
+            Phrase.id,
+            Phrase.text,
+            Phrase.order,
+            Phrase.cliente,
+            sort_by_parameter_order=True,
+        ),
+        phrases_to_create,
     ).all()
+    db.commit()
     
-    # Ordena para corresponder à ordem de inserção (aproximadamente)
-    created_by_text_order = {(p.text.strip().lower(), p.order): p for p in created_phrases}
-    result_items = []
-    for p in phrases_to_create:
-        key = (p.text.strip().lower(), p.order)
-        if key in created_by_text_order:
-            phrase = created_by_text_order[key]
-            result_items.append({
-                "id": phrase.id,
-                "text": phrase.text,
-                "order": phrase.order,
-                "cliente": phrase.cliente,
-            })
+    result_items = [
+        {"id": p.id, "text": p.text, "order": p.order, "cliente": p.cliente}
+        for p in created_phrases
+    ]
     
-    return {
+    return _json_response({
         "created": len(result_items),
         "skipped": skipped_count,
         "created_items": result_items
-    }
+    }, status_code=201)
 
 
 @app.put("/phrases/{phrase_id}", response_model=GlobalPhraseOut)
@@ -627,7 +767,7 @@ def update_global_phrase(phrase_id: int, phrase_in: GlobalPhraseUpdate, db: Sess
     phrase.cliente = phrase_in.cliente
 
     db.commit()
-    db.refresh(phrase)
+    _invalidate_cached_entity("phrase", phrase_id)
     return phrase
 
 
@@ -639,6 +779,7 @@ def delete_global_phrase(phrase_id: int, db: Session = Depends(get_db)):
 
     db.delete(phrase)
     db.commit()
+    _invalidate_cached_entity("phrase", phrase_id)
     return {"status": "deleted"}
 
 
@@ -653,6 +794,7 @@ def delete_all_phrases(db: Session = Depends(get_db)):
     db.query(MessageLog).delete(synchronize_session=False)
     db.query(Phrase).delete(synchronize_session=False)
     db.commit()
+    _invalidate_cached_entity("phrase")
 
     return {"deleted": deleted_phrases}
 
@@ -660,8 +802,73 @@ def delete_all_phrases(db: Session = Depends(get_db)):
 # ======================
 # LOG DE MENSAGENS
 # ======================
+# Cache em processo dos campos de restaurante/persona/frase exibidos no evento dm_log: o loop
+# de automação loga sempre as mesmas personas e frases. Rotas que alteram ou removem esses
+# registros invalidam a entrada; o TTL cobre escritas feitas por fora da API.
+ENTITY_CACHE_TTL_SECONDS = 300
+ENTITY_CACHE_MAXSIZE = 4096
+_ENTITY_COLUMNS = {
+    "restaurant": (Restaurant, (Restaurant.id, Restaurant.instagram_username, Restaurant.name, Restaurant.bloco)),
+    "persona": (Persona, (Persona.id, Persona.instagram_username, Persona.name)),
+    "phrase": (Phrase, (Phrase.id, Phrase.text)),
+}
+_entity_cache: dict = {}  # (tipo, id) -> (instante, dict de campos)
+# As rotas que usam o cache rodam no threadpool
+_entity_cache_lock = threading.Lock()
+
+
+def _invalidate_cached_entity(kind: str, entity_id: Optional[int] = None):
+    """Remove do cache um registro (ou todos do tipo, se `entity_id` for None)."""
+    with _entity_cache_lock:
+        if entity_id is not None:
+            _entity_cache.pop((kind, entity_id), None)
+            return
+        for key in [k for k in _entity_cache if k[0] == kind]:
+            _entity_cache.pop(key, None)
+
+
+def _cached_entity(db: Session, kind: str, entity_id) -> Optional[dict]:
+    key = (kind, entity_id)
+    now = time.monotonic()
+    with _entity_cache_lock:
+        hit = _entity_cache.get(key)
+    if hit is not None and now - hit[0] < ENTITY_CACHE_TTL_SECONDS:
+        return hit[1]
+
+    model, columns = _ENTITY_COLUMNS[kind]
+    row = db.execute(select(*columns).where(model.id == entity_id)).first()
+    if row is None:
+        # Ausência não vai para o cache: o registro pode ser criado logo depois
+        return None
+    fields = dict(row._mapping)
+    with _entity_cache_lock:
+        if len(_entity_cache) >= ENTITY_CACHE_MAXSIZE:
+            # dict mantém ordem de inserção: descarta a entrada mais antiga
+            _entity_cache.pop(next(iter(_entity_cache)), None)
+        _entity_cache[key] = (now, fields)
+    return fields
+
+
+def _publish_dm_log(event: dict):
+    """Roda no event loop: atualiza contadores, histórico e websockets com um dm_log."""
+    dm_stats["total"] += 1
+    if event["success"]:
+        dm_stats["success"] += 1
+    else:
+        dm_stats["fail"] += 1
+    # Cópia: o evento pode sair num lote depois que outros já mudaram os contadores
+    event["stats"] = dict(dm_stats)
+
+    # adiciona ao buffer de eventos recentes
+    _remember_events(event)
+
+    # Vai para os websockets no próximo lote
+    if active_websockets:
+        _enqueue_event(event)
+
+
 @app.post("/log/")
-async def log_sent_message(payload: dict, db: Session = Depends(get_db)):
+def log_sent_message(payload: dict, db: Session = Depends(get_db)):
     restaurant_id = payload.get("restaurant_id")
     persona_id = payload.get("persona_id")
     phrase_id = payload.get("phrase_id")
@@ -671,30 +878,30 @@ async def log_sent_message(payload: dict, db: Session = Depends(get_db)):
     if not all([restaurant_id, persona_id, phrase_id]):
         raise HTTPException(status_code=400, detail="restaurant_id, persona_id e phrase_id são obrigatórios")
 
-    log = MessageLog(
-        restaurant_id=restaurant_id,
-        persona_id=persona_id,
-        phrase_id=phrase_id,
-        success=success,
-        automation_run_id=automation_run_id,
-    )
-    db.add(log)
+    # INSERT ... RETURNING: id e sent_at (server default) voltam no próprio INSERT
+    log = db.execute(
+        insert(MessageLog)
+        .values(
+            restaurant_id=restaurant_id,
+            persona_id=persona_id,
+            phrase_id=phrase_id,
+            success=success,
+            automation_run_id=automation_run_id,
+        )
+        .returning(MessageLog.id, MessageLog.sent_at)
+    ).one()
     db.commit()
-    db.refresh(log)
-
-    # Atualiza contadores agregados em memória
-    dm_stats["total"] += 1
-    if success:
-        dm_stats["success"] += 1
-    else:
-        dm_stats["fail"] += 1
 
-    # Carrega informações relacionadas para enviar ao frontend
-    restaurant = db.query(Restaurant).filter(Restaurant.id == restaurant_id).first()
-    persona = db.query(Persona).filter(Persona.id == persona_id).first()
-    phrase = db.query(Phrase).filter(Phrase.id == phrase_id).first()
+    # Informações relacionadas para o frontend, do cache quando possível (vazio se o
+    # registro não existir; o evento sai mesmo assim)
+    restaurant = _cached_entity(db, "restaurant", restaurant_id) or {}
+    persona = _cached_entity(db, "persona", persona_id) or {}
+    phrase = _cached_entity(db, "phrase", phrase_id) or {}
 
     ts = log.sent_at.isoformat() if log.sent_at else None
+    rest_id = restaurant.get("id", restaurant_id)
+    pers_id = persona.get("id", persona_id)
+    phrase_id_display = phrase.get("id", phrase_id)
 
     event = {
         "type": "dm_log",
@@ -702,21 +909,20 @@ async def log_sent_message(payload: dict, db: Session = Depends(get_db)):
         "success": success,
         "sent_at": ts,
         "automation_run_id": automation_run_id,
-        "stats": dm_stats,
         "restaurant": {
-            "id": restaurant.id if restaurant else restaurant_id,
-            "instagram_username": getattr(restaurant, "instagram_username", None),
-            "name": getattr(restaurant, "name", None),
-            "bloco": getattr(restaurant, "bloco", None),
+            "id": rest_id,
+            "instagram_username": restaurant.get("instagram_username"),
+            "name": restaurant.get("name"),
+            "bloco": restaurant.get("bloco"),
         },
         "persona": {
-            "id": persona.id if persona else persona_id,
-            "instagram_username": getattr(persona, "instagram_username", None),
-            "name": getattr(persona, "name", None),
+            "id": pers_id,
+            "instagram_username": persona.get("instagram_username"),
+            "name": persona.get("name"),
         },
         "phrase": {
-            "id": phrase.id if phrase else phrase_id,
-            "text": getattr(phrase, "text", None),
+            "id": phrase_id_display,
+            "text": phrase.get("text"),
         },
     }
 
@@ -728,17 +934,12 @@ async def log_sent_message(payload: dict, db: Session = Depends(get_db)):
 
             ts_display = datetime.fromisoformat(ts).time().strftime("%H:%M:%S")
         status = "OK" if success else "FAIL"
-        rest_username = getattr(restaurant, "instagram_username", None) if restaurant else None
-        rest_name = getattr(restaurant, "name", None) if restaurant else None
-        rest_bloco = getattr(restaurant, "bloco", None) if restaurant else None
-        persona_username = getattr(persona, "instagram_username", None) if persona else None
-        persona_name = getattr(persona, "name", None) if persona else None
-        phrase_id_display = phrase.id if phrase else phrase_id
+        rest_bloco = restaurant.get("bloco")
 
         line = (
             f"[{ts_display}] {status} "
-            f"restaurante=@{rest_username or '?'} (id={restaurant.id if restaurant else restaurant_id}, bloco={rest_bloco if rest_bloco is not None else '-'}, nome={rest_name or '?'}) | "
-            f"persona=@{persona_username or '?'} (id={persona.id if persona else persona_id}, nome={persona_name or '?'}) | "
+            f"restaurante=@{restaurant.get('instagram_username') or '?'} (id={rest_id}, bloco={rest_bloco if rest_bloco is not None else '-'}, nome={restaurant.get('name') or '?'}) | "
+            f"persona=@{persona.get('instagram_username') or '?'} (id={pers_id}, nome={persona.get('name') or '?'}) | "
             f"frase#{phrase_id_display or '?'}"
         )
         event["line"] = line
@@ -746,12 +947,17 @@ async def log_sent_message(payload: dict, db: Session = Depends(get_db)):
         # Em caso de erro de formatação, simplesmente não inclui 'line'
         pass
 
-    # adiciona ao buffer de eventos recentes
-    recent_events.append(event)
-
-    # Dispara envio assíncrono para todos os websockets
-    if active_websockets:
-        asyncio.create_task(_broadcast_event(event))
+    # Rota síncrona (threadpool): contadores, histórico e broadcast ficam a cargo do loop.
+    # Sem loop (fora do lifespan ou já encerrado) o log já está gravado; só não há evento.
+    loop = _loop
+    if loop is not None and not loop.is_closed():
+        try:
+            loop.call_soon_threadsafe(_publish_dm_log, event)
+        except RuntimeError:
+            # Loop fechado entre a checagem e o agendamento
+            pass
+    else:
+        logger.debug("event loop indisponível; dm_log %s não enviado aos websockets", log.id)
 
     return {"status": "logged", "id": log.id}
 
@@ -761,19 +967,26 @@ def create_automation_run(db: Session = Depends(get_db)):
     run = AutomationRun()
     db.add(run)
     db.commit()
-    db.refresh(run)
     return {"id": run.id, "started_at": run.started_at}
 
 
 @app.post("/runs/{run_id}/finish")
 def finish_automation_run(run_id: int, db: Session = Depends(get_db)):
-    run = db.query(AutomationRun).filter(AutomationRun.id == run_id).first()
-    if not run:
-        raise HTTPException(status_code=404, detail="Run não encontrada")
-    if run.finished_at is None:
-        run.finished_at = func.now()
+    columns = (AutomationRun.id, AutomationRun.started_at, AutomationRun.finished_at)
+    # Fecha a run num único UPDATE ... RETURNING (o finished_at vem do banco, sem refresh);
+    # só faz SELECT quando a run não existe ou já estava finalizada
+    run = db.execute(
+        update(AutomationRun)
+        .where(AutomationRun.id == run_id, AutomationRun.finished_at.is_(None))
+        .values(finished_at=func.now())
+        .returning(*columns)
+    ).first()
+    if run is not None:
         db.commit()
-        db.refresh(run)
+    else:
+        run = db.execute(select(*columns).where(AutomationRun.id == run_id)).first()
+        if run is None:
+            raise HTTPException(status_code=404, detail="Run não encontrada")
     return {"id": run.id, "started_at": run.started_at, "finished_at": run.finished_at}
 
 
@@ -844,7 +1057,6 @@ def upsert_follow_status(payload: dict, db: Session = Depends(get_db)):
 
     status.last_checked = datetime.utcnow()
     db.commit()
-    db.refresh(status)
 
     return {
         "restaurant_id": status.restaurant_id,
@@ -870,6 +1082,25 @@ def list_configs(db: Session = Depends(get_db)):
     return {c.key: {"value": c.value, "description": c.description} for c in configs}
 
 
+def _upsert_configs(db: Session, rows: List[dict]) -> set:
+    """Grava várias configs em um único INSERT ... ON CONFLICT(key) DO UPDATE.
+
+    Retorna as chaves que já existiam (uma única consulta), para manter o campo `action`
+    da resposta sem um SELECT por chave.
+    """
+    if not rows:
+        return set()
+    keys = [row["key"] for row in rows]
+    existing = {k for (k,) in db.query(Config.key).filter(Config.key.in_(keys))}
+    stmt = sqlite_insert(Config).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Config.key],
+        set_={"value": stmt.excluded.value, "description": stmt.excluded.description},
+    )
+    db.execute(stmt)
+    return existing
+
+
 @app.post("/config/")
 def config_action(payload: dict, db: Session = Depends(get_db)):
     """
@@ -894,20 +1125,13 @@ def config_action(payload: dict, db: Session = Depends(get_db)):
         key = payload["key"]
         value = str(payload.get("value") or "")
         description = str(payload.get("description") or "")
-        config = db.query(Config).filter(Config.key == key).first()
-        if config:
-            config.value = value
-            config.description = description
-            action = "updated"
-        else:
-            config = Config(key=key, value=value, description=description)
-            db.add(config)
-            action = "created"
+        existing = _upsert_configs(db, [{"key": key, "value": value, "description": description}])
         db.commit()
+        action = "updated" if key in existing else "created"
         return {"status": "ok", "key": key, "value": value, "action": action}
 
     # Otherwise treat as bulk: each top-level key is a config key
-    results = []
+    rows = {}
     for key, entry in payload.items():
         if key == "_":
             continue
@@ -918,19 +1142,14 @@ def config_action(payload: dict, db: Session = Depends(get_db)):
             value = entry
             description = ""
         value = str(value) if value is not None else ""
+        rows[key] = {"key": key, "value": value, "description": description}
 
-        config = db.query(Config).filter(Config.key == key).first()
-        if config:
-            config.value = value
-            config.description = description
-            action = "updated"
-        else:
-            config = Config(key=key, value=value, description=description)
-            db.add(config)
-            action = "created"
-        results.append({"key": key, "value": value, "description": description, "action": action})
-
+    existing = _upsert_configs(db, list(rows.values()))
     db.commit()
+    results = [
+        {**row, "action": "updated" if row["key"] in existing else "created"}
+        for row in rows.values()
+    ]
     return {"status": "ok", "results": results}
 
 # ======================
@@ -1069,7 +1288,6 @@ def create_inbox_message(payload: dict, db: Session = Depends(get_db)):
             existing.received_at = received_at
         existing.email_sent = email_sent
         db.commit()
-        db.refresh(existing)
         return {
             "id": existing.id,
             "persona_id": existing.persona_id,
@@ -1096,7 +1314,6 @@ def create_inbox_message(payload: dict, db: Session = Depends(get_db)):
     
     db.add(inbox_msg)
     db.commit()
-    db.refresh(inbox_msg)
     
     return {
         "id": inbox_msg.id,
@@ -1121,7 +1338,7 @@ def list_inbox_messages(
     
     messages = query.order_by(InboxMessage.received_at.desc()).offset(skip).limit(limit).all()
     
-    return [
+    return _json_response([
         {
             "id": msg.id,
             "persona_id": msg.persona_id,
@@ -1134,14 +1351,14 @@ def list_inbox_messages(
             "email_sent": msg.email_sent,
         }
         for msg in messages
-    ]
+    ])
 
 
 @app.get("/inbox-messages/check/{item_id}")
 def check_inbox_message_exists(item_id: str, db: Session = Depends(get_db)):
     """Verifica se uma mensagem já existe pelo item_id."""
-    message = db.query(InboxMessage).filter(InboxMessage.item_id == item_id).first()
-    return {"exists": message is not None, "item_id": item_id}
+    found = db.query(exists().where(InboxMessage.item_id == item_id)).scalar()
+    return {"exists": bool(found), "item_id": item_id}
 
 
 @app.get("/inbox-messages/persona/{persona_id}/last-checked")
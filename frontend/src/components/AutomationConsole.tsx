@@ -58,21 +58,18 @@ export function AutomationConsole() {
           case "system_log":
             handleSystemLog(data);
             break;
+          case "batch":
+            // Eventos agrupados pelo servidor num único frame, na ordem em que ocorreram
+            if (Array.isArray(data.items)) {
+              data.items.forEach(handleItem);
+            }
+            break;
           case "stats":
             updateStats(data.stats);
             break;
           case "history":
             if (Array.isArray(data.items)) {
-              data.items.forEach((item: any) => {
-                if (!item || typeof item !== "object") return;
-                if (item.type === "system_log") {
-                  handleSystemLog(item);
-                } else if (item.type === "dm_log") {
-                  handleDmLog(item);
-                } else if (item.type === "stats" && item.stats) {
-                  updateStats(item.stats);
-                }
-              });
+              data.items.forEach(handleItem);
             }
             break;
           default:
@@ -83,6 +80,17 @@ export function AutomationConsole() {
       }
     };
 
+    const handleItem = (item: any) => {
+      if (!item || typeof item !== "object") return;
+      if (item.type === "system_log") {
+        handleSystemLog(item);
+      } else if (item.type === "dm_log") {
+        handleDmLog(item);
+      } else if (item.type === "stats" && item.stats) {
+        updateStats(item.stats);
+      }
+    };
+
     const updateStats = (newStats: any) => {
       if (newStats && typeof newStats === "object") {
         setStats(prev => ({